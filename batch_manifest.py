@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# Settings that don't change what gets written and so don't invalidate outputs
+IGNORED_SETTINGS = ('incremental',)
+
+
+def settings_key(settings):
+    """Stable hash of the settings that affect the output files."""
+    relevant = {k: v for k, v in settings.items() if k not in IGNORED_SETTINGS}
+    raw = json.dumps(relevant, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BatchManifest:
+    """SQLite record of which sources were already processed with which settings.
+
+    An entry is reused when the source's size and mtime still match, or,
+    failing that, when its content hash does. Records are committed every
+    commit_every files, so an interrupted batch resumes where it stopped.
+    The connection belongs to the thread that created the manifest.
+    """
+
+    def __init__(self, path, commit_every=100):
+        self.path = path
+        self.commit_every = commit_every
+        self._uncommitted = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                source TEXT NOT NULL,
+                settings_key TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                outputs TEXT NOT NULL,
+                completed_at REAL NOT NULL,
+                PRIMARY KEY (source, settings_key)
+            )
+        """)
+        self.conn.commit()
+
+    def lookup(self, source, key):
+        """Return (content_hash, size, mtime_ns, outputs) or None."""
+        row = self.conn.execute(
+            "SELECT content_hash, size, mtime_ns, outputs FROM entries WHERE source = ? AND settings_key = ?",
+            (os.path.abspath(source), key)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], row[2], json.loads(row[3])
+
+    def is_current(self, source, key, stat=None):
+        """Cheap check: same size and mtime as recorded and outputs present."""
+        entry = self.lookup(source, key)
+        if entry is None:
+            return False, None
+        content_hash, size, mtime_ns, outputs = entry
+        stat = stat or os.stat(source)
+        current = (stat.st_size == size and stat.st_mtime_ns == mtime_ns
+                   and all(os.path.exists(output) for output in outputs))
+        return current, content_hash
+
+    def record(self, source, key, content_hash, outputs, stat=None):
+        stat = stat or os.stat(source)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (os.path.abspath(source), key, content_hash, stat.st_size, stat.st_mtime_ns,
+             json.dumps(outputs), time.time())
+        )
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
@@ -0,0 +1,615 @@
+import io
+import os
+import glob
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from image_loader import open_image, reduce_on_decode, save_avif
+from image_io import encode_buffer, write_atomically, estimate_memory, MemoryBudget
+from image_resize import resize_image, scaled_size
+from compression import QUALITY_FORMATS, encode_to_target, optimize_png, parse_byte_size
+from batch_manifest import BatchManifest, settings_key, file_hash
+from color_ops import apply_color_ops, prepare_image, apply_array_ops
+import instrumentation
+from instrumentation import stage, profile_batch, profiled_call
+
+# Same extensions the GUI's Browse dialog accepts
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.avif', '.tif', '.tiff')
+
+
+def is_image_file(path):
+    return path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def iter_image_files(paths, recursive=True):
+    """Lazily yield image files from files, directories and glob patterns."""
+    for path in paths:
+        if os.path.isdir(path):
+            yield from _walk_images(path, recursive)
+        elif glob.has_magic(path):
+            for match in glob.iglob(path, recursive=recursive):
+                if os.path.isdir(match):
+                    yield from _walk_images(match, recursive)
+                elif is_image_file(match):
+                    yield match
+        elif os.path.isfile(path):
+            yield path
+
+
+def _walk_images(directory, recursive):
+    # os.scandir keeps only one directory listing in memory at a time
+    try:
+        entries = os.scandir(directory)
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    yield from _walk_images(entry.path, recursive)
+            elif is_image_file(entry.name):
+                yield entry.path
+
+
+def parse_renditions(spec):
+    """Parse "name:WxH:format[:quality][:size=BYTES][:ssim=N], ..." into a list
+    of rendition dicts. size and ssim are that rendition's target_size and
+    target_similarity.
+    """
+    renditions = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        parts = item.split(':')
+        targets = [part for part in parts[3:] if '=' in part]
+        parts = [part for part in parts if '=' not in part]
+        if len(parts) not in (3, 4):
+            raise ValueError(f"invalid rendition '{item}', expected name:WxH:format[:quality][:size=BYTES][:ssim=N]")
+        width, height = (int(n) for n in parts[1].lower().split('x'))
+        rendition = {
+            'name': parts[0],
+            'width': width,
+            'height': height,
+            'format': parts[2].lower(),
+            'quality': int(parts[3]) if len(parts) == 4 else 85,
+        }
+        for target in targets:
+            name, value = (text.strip().lower() for text in target.split('=', 1))
+            if name == 'size':
+                rendition['target_size'] = parse_byte_size(value)
+            elif name == 'ssim':
+                rendition['target_similarity'] = float(value)
+            else:
+                raise ValueError(f"invalid rendition target '{target}', expected size=BYTES or ssim=N")
+        renditions.append(rendition)
+    return renditions
+
+
+def presets_from_config(config):
+    """Map preset name -> renditions for every [PRESET <name>] section."""
+    presets = {}
+    for section in config.sections():
+        if section.startswith('PRESET '):
+            presets[section[len('PRESET '):].strip()] = parse_renditions(config[section].get('renditions', ''))
+    return presets
+
+
+def output_paths(filepath, settings):
+    """Paths process_file writes for filepath, next to it: <name>.<format>,
+    or <name>_<rendition>.<format> for each rendition of a preset.
+    """
+    base, _ = os.path.splitext(os.path.basename(filepath))
+    directory = os.path.dirname(filepath)
+    renditions = settings.get('renditions')
+    if renditions:
+        return [os.path.join(directory, f"{base}_{r['name']}.{r['format']}") for r in renditions]
+    return [os.path.join(directory, f"{base}.{settings['format']}")]
+
+
+def encode_image(img, settings, buffer=None, quality=None):
+    """Encode img in the target format and return a file object with the result.
+
+    A plain encode goes into buffer when one is given (e.g. a reused
+    EncodeBuffer); quality searches and the PNG optimizer return their own.
+    quality, when given (a rendition's own), is used whatever compress says.
+    """
+    target_format = settings['format'].lower()
+    if quality is None:
+        # Save with compression settings if enabled
+        quality = settings.get('quality', 95) if settings.get('compress') else 95
+
+    target_bytes = settings.get('target_size')
+    min_similarity = settings.get('target_similarity')
+    if target_format in QUALITY_FORMATS and (target_bytes or min_similarity):
+        buffer, _ = encode_to_target(img, target_format, target_bytes=target_bytes or None,
+                                     min_similarity=min_similarity or None,
+                                     max_quality=quality, max_iterations=settings.get('max_iterations', 8))
+        return buffer
+
+    if buffer is None:
+        buffer = io.BytesIO()
+    if target_format == 'jpg':
+        img.save(buffer, 'JPEG', quality=quality)
+    elif target_format == 'png':
+        if settings.get('compress'):
+            return optimize_png(img, time_budget=settings.get('png_time_budget', 10.0))
+        img.save(buffer, 'PNG')
+    elif target_format == 'avif':
+        save_avif(img, buffer, quality=quality)
+    else:  # webp
+        img.save(buffer, 'WEBP', quality=quality)
+    return buffer
+
+
+def _write_output(img, settings, filepath, new_filepath, quality=None):
+    with stage('encode', file=filepath, format=settings['format']) as s:
+        buffer = encode_image(img, settings, encode_buffer(), quality)
+        if instrumentation.enabled:
+            s.add(bytes_out=buffer.getbuffer().nbytes)
+
+    with stage('write', file=new_filepath), buffer.getbuffer() as view:
+        # One bulk write of the encoded bytes
+        write_atomically(new_filepath, lambda f: f.write(view))
+
+
+def _decode(filepath, size=None, mode='exact'):
+    with stage('decode', file=filepath) as s:
+        try:
+            img = open_image(filepath)
+            if size:
+                # When shrinking, let the codec skip pixels we would throw away anyway
+                reduce_on_decode(img, scaled_size(img.size, size, mode))
+            img.load()
+        except Exception as e:
+            if filepath in str(e):
+                raise
+            raise OSError(f"cannot decode '{filepath}': {e}") from e
+        if instrumentation.enabled:
+            s.add(bytes_in=os.path.getsize(filepath), width=img.width, height=img.height)
+    return img
+
+
+def _color_ops(images, settings):
+    with stage('color', images=len(images)):
+        return apply_color_ops(images, settings['color_ops'], settings.get('background', 'white'))
+
+
+def _decode_and_resize(filepath, settings):
+    width = settings.get('width')
+    height = settings.get('height')
+    resize = bool(settings.get('resize') and width and height)
+    size = (int(width), int(height)) if resize else None
+    mode = settings.get('resize_mode', 'exact')
+
+    img = _decode(filepath, size, mode)
+
+    # Resize image only if enabled
+    if resize:
+        with stage('resize', file=filepath, mode=mode):
+            img = resize_image(img, size, mode, settings.get('resample', 'bicubic'))
+    return img
+
+
+def process_file(filepath, settings):
+    """Decode, resize and encode a single image. Returns the output paths."""
+    if settings.get('renditions'):
+        return _process_renditions(filepath, settings)
+
+    img = _decode_and_resize(filepath, settings)
+    if settings.get('color_ops'):
+        # Colour work runs on the resized image, which has fewer pixels
+        img = _color_ops([img], settings)[0]
+
+    new_filepath = output_paths(filepath, settings)[0]
+    _write_output(img, settings, filepath, new_filepath)
+    return [new_filepath]
+
+
+def process_files(filepaths, settings):
+    """process_file for several files, with the colour operations run once
+    over each group of same-sized images. Returns a list of
+    (output paths, error or None) in the order of filepaths.
+    """
+    results = [([], None)] * len(filepaths)
+    decoded = []
+    for index, filepath in enumerate(filepaths):
+        try:
+            decoded.append((index, _decode_and_resize(filepath, settings)))
+        except Exception as e:
+            results[index] = ([], str(e))
+
+    images = [img for _, img in decoded]
+    ops = settings.get('color_ops')
+    if ops and images:
+        with stage('color', images=len(images)):
+            # Per image first, so one bad file doesn't fail the whole group
+            prepared = []
+            for index, img in decoded:
+                try:
+                    prepared.append((index, prepare_image(img, ops)))
+                except Exception as e:
+                    results[index] = ([], str(e))
+            decoded = prepared
+            try:
+                images = apply_array_ops([img for _, img in decoded], ops, settings.get('background', 'white'))
+            except Exception as e:
+                for index, _ in decoded:
+                    results[index] = ([], str(e))
+                decoded = images = []
+
+    for (index, _), img in zip(decoded, images):
+        filepath = filepaths[index]
+        try:
+            new_filepath = output_paths(filepath, settings)[0]
+            _write_output(img, settings, filepath, new_filepath)
+            results[index] = ([new_filepath], None)
+        except Exception as e:
+            results[index] = ([], str(e))
+    return results
+
+
+def _process_renditions(filepath, settings):
+    """Produce every rendition from a single decode.
+
+    Renditions are made largest first, and each smaller one is resized from
+    the previous result instead of from the full source (a cascade).
+    """
+    renditions = settings['renditions']
+    mode = settings.get('resize_mode', 'exact')
+    resample = settings.get('resample', 'bicubic')
+    paths = dict(zip((r['name'] for r in renditions), output_paths(filepath, settings)))
+    ordered = sorted(renditions, key=lambda r: r['width'] * r['height'], reverse=True)
+
+    source = _decode(filepath, (ordered[0]['width'], ordered[0]['height']), mode)
+    if settings.get('color_ops'):
+        # Once on the source, so every rendition gets identical levels
+        source = _color_ops([source], settings)[0]
+    current = source
+    current_key = None
+    for rendition in ordered:
+        size = (rendition['width'], rendition['height'])
+        if current_key != size:
+            # Only cascade from the previous rendition when it covers this one;
+            # a fill crop can only be reused for the same aspect ratio
+            needed = scaled_size(source.size, size, mode)
+            covers = current.width >= needed[0] and current.height >= needed[1]
+            if mode == 'fill':
+                covers = (current.width >= size[0] and current.height >= size[1]
+                          and abs(current.width / current.height - size[0] / size[1]) < 0.01)
+            base = current if covers else source
+            with stage('resize', file=filepath, rendition=rendition['name'], mode=mode):
+                current = resize_image(base, size, mode, resample)
+            current_key = size
+
+        # Byte and similarity targets only where the preset sets them for this rendition
+        rendition_settings = dict(settings, format=rendition['format'],
+                                  target_size=rendition.get('target_size'),
+                                  target_similarity=rendition.get('target_similarity'))
+        _write_output(current, rendition_settings, filepath, paths[rendition['name']], rendition['quality'])
+
+    return list(paths.values())
+
+
+def process_file_incremental(filepath, settings, known_hash=None):
+    """Hash the source, then process it unless the content matches known_hash
+    and the outputs still exist. Returns (outputs, content_hash, skipped).
+    """
+    content_hash = file_hash(filepath)
+    outputs = output_paths(filepath, settings)
+    if content_hash == known_hash and all(os.path.exists(output) for output in outputs):
+        return outputs, content_hash, True
+    process_file(filepath, settings)
+    if _overwrites_source(filepath, outputs):
+        # Converting a file to its own format replaces it; record the new content
+        content_hash = file_hash(filepath)
+    return outputs, content_hash, False
+
+
+def _overwrites_source(filepath, outputs):
+    source = os.path.abspath(filepath)
+    return any(os.path.abspath(output) == source for output in outputs)
+
+
+class BatchResult:
+    def __init__(self, total=0):
+        self.total = total
+        self.processed = 0
+        self.skipped = 0
+        self.failures = []
+        self.cancelled = False
+
+    def summary(self, max_errors=10):
+        """Build a single human readable report for the whole batch."""
+        lines = [f"Processed {self.processed} of {self.total} images"]
+        if self.skipped:
+            lines[0] += f", {self.skipped} unchanged and skipped"
+        if self.cancelled:
+            lines[0] += " (cancelled)"
+        if self.failures:
+            lines.append(f"{len(self.failures)} failed:")
+            for filepath, error in self.failures[:max_errors]:
+                lines.append(f"- {os.path.basename(filepath)}: {error}")
+            if len(self.failures) > max_errors:
+                lines.append(f"... and {len(self.failures) - max_errors} more")
+        return "\n".join(lines)
+
+
+class FileDispatcher:
+    """Hands image files to a process pool, for BatchProcessor and DirectoryWatcher.
+
+    Files are pulled from an iterator while fewer than max_pending tasks are
+    in flight and, with memory_budget (bytes per worker), while the
+    estimated memory of the files in flight fits in memory_budget * workers.
+    With a manifest, files it has up to date are settled without being
+    submitted and finished ones are recorded. batch_size > 1 sends files to
+    process_files in groups.
+
+    If a worker dies (say, killed for running out of memory) it takes the
+    pool with it. The pool is then restarted and the files that were in
+    flight are retried one at a time, so only the file that crashes a
+    worker on its own is reported as failed.
+
+    Outcomes are (filepath, outputs, error or None, skipped) tuples.
+    """
+
+    def __init__(self, settings, workers, max_pending=None, memory_budget=None, manifest=None,
+                 batch_size=1, initializer=None):
+        self.settings = settings
+        self.workers = workers
+        self.max_pending = max_pending or workers * 4
+        self.budget = MemoryBudget(memory_budget * workers) if memory_budget else None
+        self.manifest = manifest
+        self.key = settings_key(settings) if manifest is not None else None
+        self.batch_size = batch_size
+        self._initializer = initializer
+        self._executor = self._new_executor()
+        self._pending = {}  # future -> [(filepath, stat, known_hash, cost)]
+        self._suspects = deque()  # entries in flight when a worker died
+        self._isolated = None  # future retrying one suspect on its own
+        self._held = None  # entry waiting for memory
+        self._group = []  # entries gathered for one process_files call
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=self._initializer)
+
+    @property
+    def busy(self):
+        """Whether any file is submitted, waiting for memory or waiting for a retry."""
+        return bool(self._pending or self._suspects or self._group) or self._held is not None
+
+    @property
+    def retrying(self):
+        return bool(self._suspects) or self._isolated is not None
+
+    def fill(self, files):
+        """Submit files from the iterator until the pool or the memory budget
+        is full or files runs out.
+
+        Returns early with the outcomes of files settled without submitting
+        them (up to date in the manifest, or unreadable), so callers can
+        report those right away.
+        """
+        while not self.retrying and len(self._pending) < self.max_pending:
+            if self._held is not None:
+                entry = self._held
+            else:
+                filepath = next(files, None)
+                if filepath is None:
+                    break
+                stat = known_hash = None
+                if self.manifest is not None:
+                    try:
+                        stat = os.stat(filepath)
+                        current, known_hash = self.manifest.is_current(filepath, self.key, stat)
+                    except OSError as e:
+                        return [(filepath, [], str(e), False)]
+                    if current:
+                        # Unchanged since the last run - nothing to submit
+                        return [(filepath, [], None, True)]
+                cost = estimate_memory(filepath) if self.budget is not None else 0
+                entry = (filepath, stat, known_hash, cost)
+
+            if self.budget is not None and not self.budget.try_acquire(entry[3]):
+                # Submission pauses until running files release their memory
+                self._held = entry
+                break
+            self._held = None
+            self._group.append(entry)
+            if len(self._group) >= self.batch_size:
+                self._submit_group()
+        # Don't leave a partial group waiting for files that may never come
+        self._submit_group()
+        return []
+
+    def _submit_group(self):
+        if self._group:
+            self._start(self._group)
+            self._group = []
+
+    def _start(self, entries):
+        filepaths = [entry[0] for entry in entries]
+        try:
+            if self.batch_size > 1:
+                future = self._executor.submit(profiled_call, process_files, filepaths, self.settings)
+            elif self.manifest is None:
+                future = self._executor.submit(profiled_call, process_file, filepaths[0], self.settings)
+            else:
+                future = self._executor.submit(profiled_call, process_file_incremental, filepaths[0],
+                                               self.settings, entries[0][2])
+        except BrokenProcessPool:
+            self._restart(entries)
+            return None
+        self._pending[future] = list(entries)
+        return future
+
+    def _restart(self, entries=()):
+        # Every file in flight failed with the pool, but only one of them
+        # caused it: start a new pool and retry the others one at a time
+        # to find out which. Their memory stays reserved meanwhile.
+        retry = list(entries)
+        for future in list(self._pending):
+            if future.done() and not isinstance(future.exception(), BrokenProcessPool):
+                continue  # Finished before the crash; handled as usual
+            retry.extend(self._pending.pop(future))
+        self._suspects.extend(retry)
+        self._isolated = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._new_executor()
+
+    def _resume(self):
+        if self._suspects and not self._pending:
+            self._isolated = self._start([self._suspects.popleft()])
+
+    def wait(self, timeout=None):
+        """Wait up to timeout for submitted files and return their outcomes."""
+        self._resume()
+        if not self._pending:
+            return []
+        finished, _ = wait(self._pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        outcomes = []
+        crashed = False
+        for future in finished:
+            entries = self._pending.get(future)
+            if entries is None:
+                continue
+            broken = isinstance(future.exception(), BrokenProcessPool)
+            if broken and future is not self._isolated:
+                crashed = True
+                continue
+            del self._pending[future]
+            if self.budget is not None:
+                for entry in entries:
+                    self.budget.release(entry[3])
+            if future is self._isolated:
+                self._isolated = None
+            if broken:
+                # Running on its own, so this file is what killed the worker
+                self._restart()
+                outcomes.append((entries[0][0], [], "worker process crashed", False))
+            else:
+                outcomes.extend(self._outcomes(entries, future))
+        if crashed:
+            self._restart()
+        self._resume()
+        return outcomes
+
+    def _outcomes(self, entries, future):
+        if self.batch_size > 1:
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [([], str(e))] * len(entries)
+            return [(entry[0], outputs, error, False) for entry, (outputs, error) in zip(entries, results)]
+
+        filepath, stat = entries[0][:2]
+        try:
+            outcome = future.result()
+            if self.manifest is None:
+                return [(filepath, outcome, None, False)]
+            outputs, content_hash, skipped = outcome
+            if _overwrites_source(filepath, outputs):
+                stat = os.stat(filepath)
+            self.manifest.record(filepath, self.key, content_hash, outputs, stat)
+            return [(filepath, outputs, None, skipped)]
+        except Exception as e:
+            return [(filepath, [], str(e), False)]
+
+    def cancel(self):
+        """Drop everything not yet running; running files still finish."""
+        for future in self._pending:
+            future.cancel()
+        self._suspects.clear()
+        self._held = None
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class BatchProcessor:
+    """Run process_file over many images on a process pool.
+
+    With memory_budget (bytes per worker), files are only handed to the pool
+    while the estimated memory of everything in flight fits in
+    memory_budget * workers; otherwise submission pauses until running
+    files finish.
+
+    When settings include color_ops (and no manifest or renditions), files
+    are sent to process_files in groups of color_batch so the colour
+    operations can run over several same-sized images at once.
+    """
+
+    def __init__(self, max_workers=None, memory_budget=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.memory_budget = memory_budget
+
+    def run(self, files, settings, progress_callback=None, cancel_event=None, manifest_path=None):
+        """Process all files and return a BatchResult.
+
+        files may be any iterable, including a lazy generator; at most a few
+        tasks per worker are in flight so huge inputs are never listed up
+        front. progress_callback(done, total, filepath, error) is called from
+        the calling thread after each file finishes; error is None on success
+        and total is None while the input length is unknown.
+
+        With manifest_path, files already processed with the same settings
+        (per the BatchManifest there) are skipped and new results recorded.
+
+        If a worker process dies (say, killed for running out of memory), the
+        pool is restarted and only the file that crashed it is reported.
+        """
+        total = len(files) if hasattr(files, '__len__') else None
+        result = BatchResult(total or 0)
+
+        def counted(files):
+            for filepath in files:
+                if total is None:
+                    result.total += 1
+                yield filepath
+
+        files = counted(files)
+        manifest = BatchManifest(manifest_path) if manifest_path else None
+
+        workers = self.max_workers if total is None else max(1, min(self.max_workers, total))
+        batch_size = 1
+        if settings.get('color_ops') and manifest is None and not settings.get('renditions'):
+            batch_size = max(1, int(settings.get('color_batch', 8)))
+            if total:
+                # Keep every worker busy on short lists
+                batch_size = min(batch_size, max(1, -(-total // workers)))
+        dispatcher = FileDispatcher(settings, workers, memory_budget=self.memory_budget, manifest=manifest,
+                                    batch_size=batch_size)
+        done = 0
+        try:
+            with profile_batch('batch'), stage('batch', format=settings.get('format')) as batch_stage:
+                while True:
+                    outcomes = dispatcher.fill(files)
+                    if not outcomes:
+                        if not dispatcher.busy:
+                            break
+                        outcomes = dispatcher.wait()
+
+                    for filepath, _, error, skipped in outcomes:
+                        if error:
+                            result.failures.append((filepath, error))
+                        elif skipped:
+                            result.skipped += 1
+                        else:
+                            result.processed += 1
+                        done += 1
+                        if progress_callback:
+                            progress_callback(done, total, filepath, error)
+
+                    if cancel_event is not None and cancel_event.is_set():
+                        result.cancelled = True
+                        dispatcher.cancel()
+                        break
+
+                batch_stage.add(files=result.total, processed=result.processed, skipped=result.skipped,
+                                failed=len(result.failures))
+        finally:
+            dispatcher.close()
+            if manifest is not None:
+                manifest.close()
+
+        return result
@@ -0,0 +1,216 @@
+"""Reproducible benchmarks for the image pipeline and the generation client.
+
+Builds a synthetic corpus in a temporary directory, times the stages that
+process_images and show_thumbnails run (decode, thumbnail, resize, encode
+at each quality) one at a time, runs BaiduImageGenerator end to end
+against stub_server.StubServer, and writes everything to a JSON file.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --sizes 640x480,4000x3000 --formats jpg,avif --repeat 5 --skip-generation
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import PIL
+from PIL import Image
+from image_loader import open_image, save_avif, PILLOW_AVIF
+from compression import optimize_png
+from image_resize import resize_image
+
+SAVE_FORMATS = {'jpg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP', 'avif': 'AVIF'}
+QUALITIES = (50, 75, 95)
+
+
+def synthetic_image(width, height):
+    """Deterministic photo-like image: fractal detail over smooth gradients."""
+    detail = Image.effect_mandelbrot((width, height), (-2.0, -1.2, 0.8, 1.2), 64)
+    horizontal = Image.linear_gradient('L').transpose(Image.Transpose.ROTATE_90).resize((width, height))
+    vertical = Image.radial_gradient('L').resize((width, height))
+    return Image.merge('RGB', (detail, horizontal, vertical))
+
+
+def save_image(img, fp, fmt, quality=95, optimize=False, optimizer=None):
+    if fmt == 'avif':
+        save_avif(img, fp, quality=quality)
+    elif fmt == 'png' and optimizer == 'optimize_png':
+        fp.write(optimize_png(img).getbuffer())
+    elif fmt == 'png':
+        img.save(fp, 'PNG', optimize=optimize)
+    else:
+        img.save(fp, SAVE_FORMATS[fmt], quality=quality)
+
+
+def build_corpus(directory, sizes, formats):
+    """Write one synthetic source per (size, format). Returns [(fmt, size, path)]."""
+    corpus = []
+    for width, height in sizes:
+        img = synthetic_image(width, height)
+        for fmt in formats:
+            path = os.path.join(directory, f"source_{width}x{height}.{fmt}")
+            save_image(img, path, fmt, quality=90)
+            corpus.append((fmt, (width, height), path))
+    return corpus
+
+
+def measure(func, repeat):
+    """Run func repeat times; return timing stats and func's last result."""
+    timings = []
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func()
+        timings.append(time.perf_counter() - start)
+    stats = {
+        'repeat': repeat,
+        'min_s': min(timings),
+        'median_s': statistics.median(timings),
+        'mean_s': statistics.fmean(timings),
+    }
+    return stats, value
+
+
+def bench_pipeline(corpus, repeat, thumb_size=(100, 100)):
+    results = []
+
+    def record(stage, fmt, size, stats, **params):
+        entry = {'stage': stage, 'format': fmt, 'size': f"{size[0]}x{size[1]}"}
+        entry.update(params)
+        entry.update(stats)
+        results.append(entry)
+        print(f"{stage:10} {fmt:5} {entry['size']:>10} {params or ''} median {stats['median_s'] * 1000:.1f} ms")
+
+    for fmt, size, path in corpus:
+        record('decode', fmt, size, measure(lambda: open_image(path).load(), repeat)[0],
+               file_bytes=os.path.getsize(path))
+
+        def thumbnail():
+            img = open_image(path, target_size=thumb_size)
+            img.thumbnail(thumb_size)
+            return img
+        record('thumbnail', fmt, size, measure(thumbnail, repeat)[0])
+
+        decoded = open_image(path)
+        decoded.load()
+        target = (max(1, size[0] // 4), max(1, size[1] // 4))
+        for resample in ('box', 'bicubic', 'lanczos'):
+            record('resize', fmt, size, measure(lambda: resize_image(decoded, target, 'exact', resample), repeat)[0],
+                   target=f"{target[0]}x{target[1]}", resample=resample)
+
+        for out_fmt in SAVE_FORMATS:
+            if out_fmt == 'png':
+                variants = [{'optimize': False}, {'optimize': True}, {'optimizer': 'optimize_png'}]
+            else:
+                variants = [{'quality': q} for q in QUALITIES]
+            for params in variants:
+                def encode():
+                    buffer = io.BytesIO()
+                    save_image(decoded, buffer, out_fmt, **params)
+                    return buffer.tell()
+                stats, encoded_bytes = measure(encode, repeat)
+                record('save', fmt, size, stats, output_format=out_fmt, output_bytes=encoded_bytes, **params)
+
+    return results
+
+
+def bench_generation(jobs, concurrency, latency, generation_time, images_per_task):
+    """Generate/poll/download jobs against a local stub server."""
+    from image_generate import BaiduImageGenerator
+    from stub_server import StubServer
+
+    with tempfile.TemporaryDirectory() as output_dir, \
+            StubServer(latency=latency, generation_time=generation_time,
+                       images_per_task=images_per_task) as server:
+        generator = BaiduImageGenerator(output_dir=output_dir)
+        server.configure(generator)
+
+        def run_job(i):
+            start = time.perf_counter()
+            prompt = f"benchmark prompt {i}"
+            result = generator.generate_image(prompt)
+            final = generator.wait_for_completion(result['taskid'], prompt, result['token'], result['timestamp'])
+            saved = generator.save_images(final, prompt, tag=i) if final else []
+            return time.perf_counter() - start, len(saved)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(run_job, range(jobs)))
+        wall = time.perf_counter() - start
+
+        latencies = [seconds for seconds, _ in outcomes]
+        stats = generator.get_stats()
+        entry = {
+            'stage': 'generation',
+            'jobs': jobs,
+            'concurrency': concurrency,
+            'latency_s': latency,
+            'generation_time_s': generation_time,
+            'images_per_task': images_per_task,
+            'images_saved': sum(count for _, count in outcomes),
+            'wall_s': wall,
+            'job_median_s': statistics.median(latencies),
+            'job_max_s': max(latencies),
+            'query_requests': server.request_counts['query'],
+            'queries_per_job': server.request_counts['query'] / jobs,
+        }
+        entry.update(stats)
+        print(f"generation {jobs} jobs x{concurrency}: wall {wall:.2f} s, "
+              f"median job {entry['job_median_s']:.2f} s, {entry['queries_per_job']:.1f} queries/job")
+        return [entry]
+
+
+def parse_sizes(value):
+    return [tuple(int(n) for n in size.split('x')) for size in value.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the decode/resize/encode and generation paths.")
+    parser.add_argument('-o', '--output', default='benchmark_results.json')
+    parser.add_argument('--sizes', type=parse_sizes, default=parse_sizes('640x480,1920x1080,4000x3000'))
+    parser.add_argument('--formats', default='jpg,png,webp,avif',
+                        help="comma separated source formats")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-pipeline', action='store_true')
+    parser.add_argument('--skip-generation', action='store_true')
+    parser.add_argument('--jobs', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.05, help="stub server latency per request")
+    parser.add_argument('--generation-time', type=float, default=3.0)
+    parser.add_argument('--images-per-task', type=int, default=4)
+    args = parser.parse_args(argv)
+
+    formats = [fmt for fmt in args.formats.split(',') if fmt]
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'pillow_avif': PILLOW_AVIF,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeat': args.repeat,
+        },
+        'results': [],
+    }
+
+    if not args.skip_pipeline:
+        with tempfile.TemporaryDirectory() as corpus_dir:
+            corpus = build_corpus(corpus_dir, args.sizes, formats)
+            report['results'].extend(bench_pipeline(corpus, args.repeat))
+
+    if not args.skip_generation:
+        report['results'].extend(bench_generation(args.jobs, args.concurrency, args.latency,
+                                                  args.generation_time, args.images_per_task))
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Colour and tone clean-up applied between decode and encode.
+
+Operations run in a fixed order whatever order they are listed in:
+
+    srgb       convert images with an embedded ICC profile to sRGB
+    normalize  bring every mode to 8-bit RGB, or RGBA when there is alpha
+    flatten    composite alpha onto a background colour
+    autolevel  stretch each channel so its darkest/brightest 0.5% clip
+
+The array operations work on NumPy stacks of same-sized images, so a
+batch of N photos from the same camera costs one call per operation
+rather than N. They need 8-bit RGB(A) input, so they imply normalize;
+otherwise images keep their mode unless normalize is asked for.
+"""
+import io
+from PIL import Image, ImageColor
+
+try:
+    from PIL import ImageCms
+except ImportError:  # Pillow built without littlecms
+    ImageCms = None
+
+COLOR_OPS = ('srgb', 'normalize', 'flatten', 'autolevel')
+ARRAY_OPS = ('flatten', 'autolevel')
+
+_SRGB_PROFILE = None
+
+
+def parse_color_ops(spec):
+    """Parse "flatten,autolevel" into a list of operation names."""
+    ops = [op.strip().lower() for op in spec.split(',') if op.strip()]
+    for op in ops:
+        if op not in COLOR_OPS:
+            raise ValueError(f"unknown color operation '{op}', expected one of {', '.join(COLOR_OPS)}")
+    return ops
+
+
+def to_srgb(img):
+    """Convert img from its embedded ICC profile to sRGB; images without one are left alone."""
+    global _SRGB_PROFILE
+    icc_profile = img.info.get('icc_profile')
+    if not icc_profile or ImageCms is None:
+        return img
+    if _SRGB_PROFILE is None:
+        _SRGB_PROFILE = ImageCms.createProfile('sRGB')
+    source = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+    output_mode = 'RGBA' if 'A' in img.getbands() else 'RGB'
+    if img.mode not in ('RGB', 'RGBA', 'CMYK', 'L', 'LA'):
+        img = img.convert(output_mode)
+    converted = ImageCms.profileToProfile(img, source, _SRGB_PROFILE, outputMode=output_mode)
+    converted.info.pop('icc_profile', None)
+    return converted
+
+
+def normalize_mode(img):
+    """Return img as 8-bit RGB, or RGBA if it has any transparency."""
+    if img.mode in ('RGB', 'RGBA'):
+        return img
+    import numpy as np
+    if img.mode.startswith('I') or img.mode == 'F':
+        # Wide integer/float images: scale 16-bit ranges down instead of clipping
+        pixels = np.asarray(img)
+        if pixels.max() > 255:
+            pixels = pixels / 257.0
+        img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'L')
+    has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+    return img.convert('RGBA' if has_alpha else 'RGB')
+
+
+def flatten(batch, background=(255, 255, 255)):
+    """Composite a (N, H, W, 4) uint8 stack onto background; returns (N, H, W, 3)."""
+    import numpy as np
+    if batch.shape[-1] != 4:
+        return batch
+    alpha = batch[..., 3:4].astype(np.uint16)
+    rgb = batch[..., :3].astype(np.uint16)
+    bg = np.asarray(background[:3], dtype=np.uint16)
+    return ((rgb * alpha + bg * (255 - alpha) + 127) // 255).astype(np.uint8)
+
+
+def autolevel(batch, clip=0.005):
+    """Stretch every colour channel of every image in a (N, H, W, C) uint8 stack
+    so the darkest and brightest clip fraction of its pixels map to 0 and 255.
+    An alpha channel (C == 4) is left alone.
+    """
+    import numpy as np
+    n, height, width, channels = batch.shape
+    colour = min(channels, 3)
+    pixels = height * width
+
+    histograms = np.empty((n, colour, 256), dtype=np.int64)
+    for i in range(n):
+        for c in range(colour):
+            histograms[i, c] = np.bincount(batch[i, ..., c].ravel(), minlength=256)
+    cdf = histograms.cumsum(axis=2)
+    low = (cdf > pixels * clip).argmax(axis=2)
+    high = (cdf >= pixels * (1 - clip)).argmax(axis=2)
+    # Flat channels keep their values
+    flat = high <= low
+    scale = np.where(flat, 1.0, 255.0 / np.maximum(high - low, 1)).astype(np.float32)
+    offset = np.where(flat, 0, low).astype(np.float32)
+
+    # One pass over the whole stack, with a single float temporary
+    levels = batch[..., :colour].astype(np.float32)
+    levels -= offset[:, None, None, :]
+    levels *= scale[:, None, None, :]
+    levels += 0.5
+    np.clip(levels, 0, 255, out=levels)
+    out = batch.copy()
+    out[..., :colour] = levels
+    return out
+
+
+def prepare_image(img, ops):
+    """Run the per-image steps of ops on img: srgb, then normalize if it is
+    listed or an array operation needs it."""
+    if 'srgb' in ops:
+        img = to_srgb(img)
+    if 'normalize' in ops or any(op in ops for op in ARRAY_OPS):
+        img = normalize_mode(img)
+    return img
+
+
+def apply_array_ops(images, ops, background='white'):
+    """Run the array steps of ops over images already through prepare_image.
+
+    Images with the same size and mode are stacked and processed together.
+    """
+    if not any(op in ops for op in ARRAY_OPS):
+        return list(images)
+    import numpy as np
+    background = ImageColor.getrgb(background) if isinstance(background, str) else tuple(background)
+
+    groups = {}
+    for index, img in enumerate(images):
+        groups.setdefault((img.size, img.mode), []).append(index)
+
+    results = list(images)
+    for (size, mode), indices in groups.items():
+        batch = np.stack([np.asarray(images[i]) for i in indices])
+        if 'flatten' in ops:
+            batch = flatten(batch, background)
+        if 'autolevel' in ops:
+            batch = autolevel(batch)
+        out_mode = 'RGBA' if batch.shape[-1] == 4 else 'RGB'
+        for i, pixels in zip(indices, batch):
+            results[i] = Image.fromarray(pixels, out_mode)
+    return results
+
+
+def apply_color_ops(images, ops, background='white'):
+    """Apply ops to a list of PIL images and return the new list in the same order."""
+    if not ops:
+        return list(images)
+    return apply_array_ops([prepare_image(img, ops) for img in images], ops, background)
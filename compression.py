@@ -0,0 +1,380 @@
+import io
+import struct
+import time
+import zlib
+from PIL import Image
+from image_loader import save_avif
+
+QUALITY_FORMATS = {'jpg': 'JPEG', 'webp': 'WEBP', 'avif': 'AVIF'}
+
+
+def encode_quality(img, fmt, quality):
+    """Encode img at quality into a new BytesIO."""
+    buffer = io.BytesIO()
+    if fmt == 'avif':
+        save_avif(img, buffer, quality=quality)
+    else:
+        img.save(buffer, QUALITY_FORMATS[fmt], quality=quality)
+    return buffer
+
+
+def _luma(img, max_side=512):
+    """Grayscale float array, downscaled so similarity checks stay cheap."""
+    import numpy as np
+    gray = img.convert('L')
+    if max(gray.size) > max_side:
+        gray = gray.copy()
+        gray.thumbnail((max_side, max_side))
+    return np.asarray(gray, dtype=np.float64)
+
+
+def _box_mean(a, window):
+    """Mean over every window x window block, via a summed-area table."""
+    import numpy as np
+    table = np.pad(a, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+    sums = (table[window:, window:] - table[:-window, window:]
+            - table[window:, :-window] + table[:-window, :-window])
+    return sums / (window * window)
+
+
+def ssim(reference, candidate, window=7):
+    """Mean structural similarity of two equally sized grayscale arrays."""
+    if min(reference.shape) < window:
+        window = max(1, min(reference.shape))
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    mu_x = _box_mean(reference, window)
+    mu_y = _box_mean(candidate, window)
+    var_x = _box_mean(reference * reference, window) - mu_x * mu_x
+    var_y = _box_mean(candidate * candidate, window) - mu_y * mu_y
+    cov = _box_mean(reference * candidate, window) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / ((mu_x ** 2 + mu_y ** 2 + c1) * (var_x + var_y + c2))
+    return float(ssim_map.mean())
+
+
+def encode_to_target(img, fmt, target_bytes=None, min_similarity=None, min_quality=10, max_quality=95,
+                     max_iterations=8):
+    """Binary-search the encoder quality for a byte budget and/or an SSIM floor.
+
+    Every attempt encodes the same decoded image into memory. With only
+    target_bytes, the highest quality that fits is chosen; with only
+    min_similarity, the lowest quality that reaches it. With both, the
+    similarity answer is used unless it breaks the budget, which wins.
+    If nothing fits the budget the min_quality encoding is returned.
+    Returns (buffer, quality).
+    """
+    attempts = {}
+    reference = _luma(img) if min_similarity is not None else None
+
+    def attempt(quality):
+        if quality not in attempts:
+            buffer = encode_quality(img, fmt, quality)
+            similarity = None
+            if reference is not None:
+                buffer.seek(0)
+                decoded = Image.open(buffer)
+                similarity = ssim(reference, _luma(decoded))
+            attempts[quality] = (buffer, buffer.getbuffer().nbytes, similarity)
+        return attempts[quality]
+
+    def search(predicate, want_highest):
+        """Find the highest (or lowest) quality satisfying a monotone predicate."""
+        lo, hi = min_quality, max_quality
+        found = None
+        while lo <= hi and len(attempts) < max_iterations:
+            quality = (lo + hi) // 2
+            if predicate(attempt(quality)):
+                found = quality
+                if want_highest:
+                    lo = quality + 1
+                else:
+                    hi = quality - 1
+            elif want_highest:
+                hi = quality - 1
+            else:
+                lo = quality + 1
+        return found
+
+    quality = max_quality
+    if min_similarity is not None:
+        found = search(lambda a: a[2] >= min_similarity, want_highest=False)
+        quality = found if found is not None else max_quality
+    if target_bytes is not None and attempt(quality)[1] > target_bytes:
+        found = search(lambda a: a[1] <= target_bytes, want_highest=True)
+        quality = found if found is not None else min_quality
+
+    return attempt(quality)[0], quality
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_COLOR_TYPES = {'L': 0, 'RGB': 2, 'P': 3, 'LA': 4, 'RGBA': 6}
+PNG_FILTERS = ('adaptive', 'none', 'sub', 'up', 'average', 'paeth')
+# Fastest first: a slower strategy has to earn its cost, see MIN_GAIN
+ZLIB_STRATEGIES = (zlib.Z_RLE, zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED)
+# Bytes of raw rows filtered per band
+FILTER_BAND_BYTES = 1024 * 1024
+# Filters and strategies are compared on a sample of the rows in
+# SAMPLE_BANDS bands, compressed at TRIAL_LEVEL
+SAMPLE_FRACTION = 32
+MIN_SAMPLE_BYTES = 64 * 1024
+MAX_SAMPLE_BYTES = 512 * 1024
+SAMPLE_BANDS = 4
+TRIAL_LEVEL = 6
+# Level 9 takes two to three times as long as 8 for a few percent
+FINAL_LEVEL = 8
+# Smallest relative saving on the sample worth a slower strategy
+MIN_GAIN = 0.005
+
+
+def _reduce_losslessly(img):
+    """Return an equivalent image in the smallest PNG colour type, or None
+    for modes this optimizer doesn't handle. Comes back as (image, tRNS
+    chunk data or None): palette alphas for P, a colour key for L and RGB.
+    """
+    import numpy as np
+    if img.mode == 'P' or (img.mode in ('L', 'RGB') and 'transparency' in img.info):
+        # Work with explicit alpha; a colour key is recovered at the end
+        img = img.convert('LA' if img.mode == 'L' else 'RGBA')
+    elif img.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+        return None
+
+    # Drop an alpha channel that is fully opaque
+    if img.mode in ('LA', 'RGBA') and img.getchannel('A').getextrema() == (255, 255):
+        img = img.convert(img.mode[:-1])
+
+    # Colour images whose channels are all equal are really grayscale
+    if img.mode in ('RGB', 'RGBA'):
+        r, g, b = (np.asarray(img.getchannel(band)) for band in 'RGB')
+        if np.array_equal(r, g) and np.array_equal(g, b):
+            img = img.convert('LA' if img.mode == 'RGBA' else 'L')
+
+    key = _colour_key(img) if img.mode in ('LA', 'RGBA') else None
+    # Gray plus a colour key beats a palette; colour with one usually doesn't
+    if img.mode in ('RGB', 'RGBA', 'LA') and img.getcolors(256) is not None \
+            and not (key is not None and img.mode == 'LA'):
+        return _to_palette(img)
+    if key is not None:
+        return img.convert(img.mode[:-1]), struct.pack(f'>{len(key)}H', *key)
+    return img, None
+
+
+def _colour_key(img):
+    """The single colour of every transparent pixel in an LA/RGBA image, if
+    its alpha is only 0 or 255 and no opaque pixel has that colour, else None.
+    """
+    import numpy as np
+    pixels = np.asarray(img)
+    alpha = pixels[..., -1]
+    transparent = alpha == 0
+    if not (transparent | (alpha == 255)).all():
+        return None
+    colours = pixels[..., :-1]
+    keys = colours[transparent]
+    if (keys != keys[0]).any():
+        return None
+    key = keys[0]
+    if (colours[~transparent] == key).all(axis=-1).any():
+        return None
+    return tuple(int(value) for value in key)
+
+
+def _to_palette(img):
+    """Exact palette conversion of an image known to have <= 256 colours."""
+    import numpy as np
+    rgba = img.convert('RGBA')
+    colors = np.array([color for _, color in rgba.getcolors(256)], dtype=np.uint8)
+    keys = np.sort(colors.view(np.uint32).ravel())
+    colors = keys.view(np.uint8).reshape(-1, 4)
+
+    # Look pixels up a band at a time to keep the index temporaries small
+    pixels = np.asarray(rgba)
+    indices = np.empty(pixels.shape[:2], dtype=np.uint8)
+    band = max(1, FILTER_BAND_BYTES // (rgba.width * 4))
+    for start in range(0, rgba.height, band):
+        rows = pixels[start:start + band]
+        indices[start:start + band] = np.searchsorted(keys, rows.view(np.uint32)[..., 0])
+
+    paletted = Image.fromarray(indices, 'P')
+    paletted.putpalette(colors[:, :3].tobytes())
+    alpha = colors[:, 3]
+    if (alpha == 255).all():
+        return paletted, None
+    # tRNS may omit trailing opaque entries
+    last = int(np.nonzero(alpha != 255)[0][-1]) + 1
+    return paletted, alpha[:last].tobytes()
+
+
+def _filter_rows(rows, above, bpp, kinds):
+    """Yield (kind, filtered rows) for each PNG row filter type in kinds,
+    applied to rows (uint8, n x stride) lying below the row above."""
+    import numpy as np
+    x = rows.astype(np.int16)
+    up = np.empty_like(x)
+    up[0] = above
+    up[1:] = x[:-1]
+    left = np.zeros_like(x)
+    left[:, bpp:] = x[:, :-bpp]
+    for kind in kinds:
+        if kind == 0:
+            yield kind, rows
+            continue
+        if kind == 1:
+            out = x - left
+        elif kind == 2:
+            out = x - up
+        elif kind == 3:
+            out = x - (left + up) // 2
+        else:
+            up_left = np.zeros_like(x)
+            up_left[:, bpp:] = up[:, :-bpp]
+            estimate = left + up - up_left
+            pa = np.abs(estimate - left)
+            pb = np.abs(estimate - up)
+            pc = np.abs(estimate - up_left)
+            predictor = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, up_left))
+            out = x - predictor
+        yield kind, (out & 0xFF).astype(np.uint8)
+
+
+def _filter_band(rows, above, bpp, name):
+    """Filter rows (uint8, n x stride) lying below the row above; returns
+    them prefixed with their filter type byte, ready for deflate."""
+    import numpy as np
+    out = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+    if name != 'adaptive':
+        kind = PNG_FILTERS.index(name) - 1
+        out[:, 0] = kind
+        out[:, 1:] = next(_filter_rows(rows, above, bpp, (kind,)))[1]
+        return out
+    # Per row, pick the filter with the smallest sum of absolute values,
+    # reading the filtered bytes as signed
+    for kind, filtered in _filter_rows(rows, above, bpp, range(5)):
+        scores = np.minimum(filtered, 0 - filtered).sum(axis=1, dtype=np.uint32)
+        if kind == 0:
+            best_scores = scores
+            out[:, 0] = 0
+            out[:, 1:] = filtered
+            continue
+        better = scores < best_scores
+        best_scores = np.minimum(scores, best_scores)
+        out[better, 0] = kind
+        out[better, 1:] = filtered[better]
+    return out
+
+
+def _filtered_scanlines(raw, bpp, name):
+    """All scanlines of raw filtered with name, a band at a time so the
+    int16 temporaries stay small whatever the image size."""
+    import numpy as np
+    height, stride = raw.shape
+    out = np.empty((height, stride + 1), dtype=np.uint8)
+    band = max(1, FILTER_BAND_BYTES // stride)
+    zero = np.zeros(stride, dtype=np.uint8)
+    for start in range(0, height, band):
+        above = raw[start - 1] if start else zero
+        out[start:start + band] = _filter_band(raw[start:start + band], above, bpp, name)
+    return out
+
+
+def _sample_bands(raw):
+    """Evenly spaced (rows, above) bands of raw for trial compression, about
+    1/SAMPLE_FRACTION of it, but no less than MIN_SAMPLE_BYTES (so small
+    images are used whole) and no more than MAX_SAMPLE_BYTES."""
+    import numpy as np
+    height, stride = raw.shape
+    zero = np.zeros(stride, dtype=np.uint8)
+    size = min(max(height * stride // SAMPLE_FRACTION, MIN_SAMPLE_BYTES), MAX_SAMPLE_BYTES)
+    if height * stride <= size:
+        return [(raw, zero)]
+    rows = max(1, size // (SAMPLE_BANDS * stride))
+    step = max(height // SAMPLE_BANDS, rows)
+    return [(raw[start:start + rows], raw[start - 1] if start else zero)
+            for start in range(0, height - rows + 1, step)[:SAMPLE_BANDS]]
+
+
+def _png_chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+
+def optimize_png(img, time_budget=10.0):
+    """Losslessly find a small PNG encoding of img. Returns a BytesIO.
+
+    The image is first reduced to the smallest exact colour type: opaque
+    alpha is dropped, gray RGB becomes L, <= 256 colours become a palette
+    and binary transparency becomes a colour key. Row filters, then zlib
+    strategies, are compared by compressing a sample of the rows at
+    TRIAL_LEVEL, and only the winner is deflated in full at FINAL_LEVEL.
+    A slower strategy is only used when it saves MIN_GAIN on the sample;
+    on photos Z_RLE is as small and several times faster. Trials stop
+    once time_budget seconds have passed. Unsupported modes fall back to
+    Pillow's optimize=True.
+    """
+    import numpy as np
+    icc_profile = img.info.get('icc_profile')
+    reduced = _reduce_losslessly(img)
+    if reduced is None:
+        buffer = io.BytesIO()
+        img.save(buffer, 'PNG', optimize=True)
+        return buffer
+    img, transparency = reduced
+
+    bpp = len(img.getbands()) if img.mode != 'P' else 1
+    raw = np.asarray(img, dtype=np.uint8).reshape(img.height, img.width * bpp)
+    bands = _sample_bands(raw)
+    deadline = time.monotonic() + time_budget if time_budget else None
+
+    def trial(name, strategy=zlib.Z_DEFAULT_STRATEGY):
+        if name not in samples:
+            samples[name] = [_filter_band(rows, above, bpp, name) for rows, above in bands]
+        compressor = zlib.compressobj(TRIAL_LEVEL, zlib.DEFLATED, 15, 9, strategy)
+        return sum(len(compressor.compress(band)) for band in samples[name]) + len(compressor.flush())
+
+    def expired():
+        return deadline is not None and time.monotonic() >= deadline
+
+    # Palette images rarely gain from filtering, so try "none" first for them
+    filters = PNG_FILTERS if img.mode != 'P' else ('none',) + tuple(f for f in PNG_FILTERS if f != 'none')
+    samples = {}
+    sizes = {filters[0]: trial(filters[0])}
+    for name in filters[1:]:
+        if expired():
+            break
+        sizes[name] = trial(name)
+    best_filter = min(sizes, key=sizes.get)
+    sizes = {zlib.Z_DEFAULT_STRATEGY: sizes[best_filter]}
+    for strategy in ZLIB_STRATEGIES:
+        if strategy not in sizes and not expired():
+            sizes[strategy] = trial(best_filter, strategy)
+    # The fastest strategy that is within MIN_GAIN of the smallest
+    smallest = min(sizes.values())
+    best_strategy = next(strategy for strategy in ZLIB_STRATEGIES
+                         if strategy in sizes and sizes[strategy] * (1 - MIN_GAIN) <= smallest)
+
+    compressor = zlib.compressobj(FINAL_LEVEL, zlib.DEFLATED, 15, 9, best_strategy)
+    best = compressor.compress(_filtered_scanlines(raw, bpp, best_filter)) + compressor.flush()
+
+    header = struct.pack('>IIBBBBB', img.width, img.height, 8, PNG_COLOR_TYPES[img.mode], 0, 0, 0)
+    chunks = [_png_chunk(b'IHDR', header)]
+    if icc_profile:
+        chunks.append(_png_chunk(b'iCCP', b'ICC Profile\x00\x00' + zlib.compress(icc_profile)))
+    if img.mode == 'P':
+        chunks.append(_png_chunk(b'PLTE', img.palette.tobytes()))
+    if transparency:
+        chunks.append(_png_chunk(b'tRNS', transparency))
+    chunks.append(_png_chunk(b'IDAT', best))
+    chunks.append(_png_chunk(b'IEND', b''))
+
+    buffer = io.BytesIO()
+    buffer.write(PNG_SIGNATURE)
+    for chunk in chunks:
+        buffer.write(chunk)
+    return buffer
+
+
+def parse_byte_size(value):
+    """Parse "150000", "150KB" or "1.5MB" into a number of bytes."""
+    text = str(value).strip().upper()
+    for suffix, factor in (('KB', 1024), ('MB', 1024 * 1024), ('K', 1024), ('M', 1024 * 1024), ('B', 1)):
+        if text.endswith(suffix):
+            return int(float(text[:-len(suffix)]) * factor)
+    return int(float(text))
@@ -0,0 +1,158 @@
+import os
+import signal
+import time
+from collections import deque
+from batch_processor import FileDispatcher, iter_image_files
+from batch_manifest import BatchManifest
+
+
+def _ignore_interrupt():
+    # Ctrl+C is handled by the watching process, which cancels the work
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class DirectoryWatcher:
+    """Process images dropped into directories as they arrive.
+
+    The directories are rescanned every `interval` seconds (plain polling, so
+    it works the same on network shares). A file is picked up once its size
+    and mtime have not changed for `settle_time` seconds, so half-copied
+    uploads are left alone, and again whenever it changes later on. Files
+    this watcher wrote itself are recognised by their size and mtime and
+    skipped, so converting in place doesn't loop.
+
+    Ready files wait in a FIFO and at most `max_pending` are handed to the
+    process pool at a time; a burst of uploads queues up instead of
+    flooding the workers. With memory_budget (bytes per worker) they also
+    wait while the estimated memory of the files in flight is used up, as
+    in BatchProcessor. With manifest_path, files the BatchManifest there
+    already has up to date with these settings are skipped, across restarts
+    too. Files go through a FileDispatcher, so a worker that crashes only
+    fails the file it was working on and watching carries on.
+    on_result(filepath, outputs, error) is called from the thread running
+    run() after each file.
+    """
+
+    def __init__(self, directories, settings, recursive=True, interval=1.0, settle_time=2.0,
+                 max_workers=None, max_pending=None, process_existing=False, on_result=None,
+                 memory_budget=None, manifest_path=None):
+        self.directories = list(directories)
+        self.settings = settings
+        self.recursive = recursive
+        self.interval = interval
+        self.settle_time = settle_time
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 2
+        self.process_existing = process_existing
+        self.on_result = on_result
+        self.memory_budget = memory_budget
+        self.manifest_path = manifest_path
+
+        self._candidates = {}  # path -> (size, mtime_ns) seen on the last scan while settling
+        self._done = {}        # path -> (size, mtime_ns) when it was last processed
+        self._outputs = {}     # path -> (size, mtime_ns) of files we wrote
+        self._ready = deque()
+        self._queued = set()
+        self.processed = 0
+        self.failed = 0
+
+    def _signature(self, path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _scan(self):
+        now_ns = time.time_ns()
+        settle_ns = int(self.settle_time * 1e9)
+        seen = set()
+        for path in iter_image_files(self.directories, self.recursive):
+            path = os.path.abspath(path)
+            if os.path.basename(path).startswith('.'):
+                continue
+            seen.add(path)
+            try:
+                signature = self._signature(path)
+            except OSError:
+                continue  # Removed or renamed during the scan
+            if self._outputs.get(path) == signature or self._done.get(path) == signature:
+                continue
+            if path in self._queued:
+                continue
+            previous = self._candidates.get(path)
+            self._candidates[path] = signature
+            # Ready once unchanged across scans and untouched for settle_time
+            if previous == signature and now_ns - signature[1] >= settle_ns:
+                del self._candidates[path]
+                self._ready.append(path)
+                self._queued.add(path)
+
+        for path in list(self._candidates):
+            if path not in seen:
+                del self._candidates[path]
+
+    def _mark_existing(self):
+        """Treat everything already present as processed."""
+        for path in iter_image_files(self.directories, self.recursive):
+            try:
+                self._done[os.path.abspath(path)] = self._signature(path)
+            except OSError:
+                pass
+
+    def _finish(self, filepath, outputs, error, skipped):
+        self._queued.discard(filepath)
+        for output in outputs:
+            try:
+                self._outputs[os.path.abspath(output)] = self._signature(output)
+            except OSError:
+                pass
+        try:
+            # An output may have replaced the source (same format)
+            self._done[filepath] = self._outputs.get(filepath) or self._signature(filepath)
+        except OSError:
+            pass
+        if skipped:
+            return  # Up to date in the manifest
+        if error:
+            self.failed += 1
+        else:
+            self.processed += 1
+        if self.on_result:
+            self.on_result(filepath, outputs, error)
+
+    def _take_ready(self):
+        while self._ready:
+            yield self._ready.popleft()
+
+    def run(self, stop_event=None):
+        """Watch until stop_event is set (or forever). Returns (processed, failed)."""
+        if not self.process_existing:
+            self._mark_existing()
+
+        # Files trickle in, so record each one in the manifest straight away
+        manifest = BatchManifest(self.manifest_path, commit_every=1) if self.manifest_path else None
+        dispatcher = FileDispatcher(self.settings, self.max_workers, self.max_pending, self.memory_budget,
+                                    manifest, initializer=_ignore_interrupt)
+        try:
+            next_scan = 0
+            while stop_event is None or not stop_event.is_set():
+                now = time.monotonic()
+                if now >= next_scan:
+                    self._scan()
+                    next_scan = now + self.interval
+
+                outcomes = dispatcher.fill(self._take_ready())
+                if not outcomes:
+                    timeout = max(0.05, next_scan - time.monotonic())
+                    if dispatcher.busy:
+                        outcomes = dispatcher.wait(timeout)
+                    elif stop_event is not None:
+                        stop_event.wait(timeout)
+                    else:
+                        time.sleep(timeout)
+                for outcome in outcomes:
+                    self._finish(*outcome)
+            dispatcher.cancel()
+        finally:
+            dispatcher.close()
+            if manifest is not None:
+                manifest.close()
+        return self.processed, self.failed
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+
+# Must change whenever generate_image starts sending different model parameters
+MODEL_PARAMETERS = {'modelParameter[id]': '1', 'modelParameter[quality]': '1'}
+
+
+def normalize_prompt(prompt):
+    """Fold case, Unicode width forms and whitespace so trivially different prompts match."""
+    return " ".join(unicodedata.normalize('NFKC', prompt).casefold().split())
+
+
+def request_key(prompt, width, height, variant=0):
+    """Cache key for one generation: normalized prompt, size, model and variant.
+
+    variant tells apart the images of a multi-image request, so asking for
+    four images again returns the same four rather than one image four times.
+    """
+    raw = json.dumps([normalize_prompt(prompt), int(width), int(height), int(variant), MODEL_PARAMETERS],
+                     sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def content_hash(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link_or_copy(source, destination):
+    """Atomically make destination a hard link to source, copying where links aren't possible."""
+    directory = os.path.dirname(destination) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+    os.close(fd)
+    os.remove(temp_path)
+    try:
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, destination)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class GenerationCache:
+    """Content-addressed store of generated images, indexed by request.
+
+    Each downloaded image is stored once under objects/ by its SHA-256, and
+    an SQLite index maps request keys (see request_key) to the hashes they
+    produced. Files handed out to the output directory are hard links to
+    the stored objects where the filesystem allows, so identical images take
+    space once. Requests are evicted least recently used first once the
+    objects grow past max_bytes, along with objects nothing refers to any more.
+    """
+
+    def __init__(self, cache_dir=".generation_cache", max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'), check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS requests (
+                key TEXT PRIMARY KEY,
+                prompt TEXT NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                variant INTEGER NOT NULL,
+                hashes TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS objects (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest + '.jpg')
+
+    def lookup(self, prompt, width, height, variant=0):
+        """Return the cached image paths for a request, or None on a miss."""
+        key = request_key(prompt, width, height, variant)
+        with self._lock:
+            row = self.conn.execute("SELECT hashes FROM requests WHERE key = ?", (key,)).fetchone()
+            paths = [self.object_path(digest) for digest in json.loads(row[0])] if row else None
+            if paths and all(os.path.exists(path) for path in paths):
+                self.conn.execute("UPDATE requests SET last_used = ? WHERE key = ?", (time.time(), key))
+                self.conn.commit()
+                self.hits += 1
+                return paths
+            if row:
+                # Objects were removed behind our back
+                self.conn.execute("DELETE FROM requests WHERE key = ?", (key,))
+                self.conn.commit()
+            self.misses += 1
+            return None
+
+    def store(self, prompt, width, height, files, variant=0):
+        """Add freshly downloaded files to the store under their request.
+
+        Each file is replaced by a link to its stored object, so duplicates
+        across requests end up sharing one copy on disk.
+        """
+        hashes = []
+        added = 0
+        for path in files:
+            digest = content_hash(path)
+            stored = self.object_path(digest)
+            with self._lock:
+                known = self.conn.execute("SELECT 1 FROM objects WHERE hash = ?", (digest,)).fetchone()
+            if known and os.path.exists(stored):
+                _link_or_copy(stored, path)
+            else:
+                os.makedirs(os.path.dirname(stored), exist_ok=True)
+                _link_or_copy(path, stored)
+                size = os.path.getsize(stored)
+                with self._lock:
+                    self.conn.execute("INSERT OR REPLACE INTO objects VALUES (?, ?)", (digest, size))
+                added += 1
+            hashes.append(digest)
+
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO requests VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (request_key(prompt, width, height, variant), prompt, width, height, variant,
+                 json.dumps(hashes), now, now)
+            )
+            self.conn.commit()
+        if added:
+            self._evict()
+        return hashes
+
+    def export(self, paths, destinations):
+        """Place cached images at destinations (links where possible)."""
+        for source, destination in zip(paths, destinations):
+            _link_or_copy(source, destination)
+        return list(destinations)
+
+    def get_stats(self):
+        with self._lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM requests").fetchone()[0]
+            objects, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects").fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'objects': objects, 'bytes': size}
+
+    def _evict(self):
+        """Drop least recently used requests until the objects fit in 90% of max_bytes."""
+        with self._lock:
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            target = self.max_bytes * 0.9
+            requests = self.conn.execute("SELECT key, hashes FROM requests ORDER BY last_used").fetchall()
+            for key, hashes in requests:
+                if total <= target:
+                    break
+                self.conn.execute("DELETE FROM requests WHERE key = ?", (key,))
+                for digest in json.loads(hashes):
+                    # Objects may be shared with requests we keep
+                    still_used = self.conn.execute(
+                        "SELECT 1 FROM requests WHERE hashes LIKE ? LIMIT 1", (f'%"{digest}"%',)
+                    ).fetchone()
+                    if still_used:
+                        continue
+                    row = self.conn.execute("SELECT size FROM objects WHERE hash = ?", (digest,)).fetchone()
+                    if row is None:
+                        continue
+                    self.conn.execute("DELETE FROM objects WHERE hash = ?", (digest,))
+                    try:
+                        os.remove(self.object_path(digest))
+                    except OSError:
+                        pass
+                    total -= row[0]
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
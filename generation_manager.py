@@ -0,0 +1,160 @@
+import io
+import itertools
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import stage
+
+
+class GenerationJob:
+    """State of one remote generation, updated from a worker thread."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, prompt, width, height, variant=0, use_cache=True):
+        self.id = next(self._ids)
+        self.prompt = prompt
+        self.width = width
+        self.height = height
+        self.variant = variant  # index within a multi-image request, part of the cache key
+        self.use_cache = use_cache
+        self.cached = False
+        self.status = 'queued'  # queued, running, done, failed, cancelled
+        self.progress = 0
+        self.saved_files = []
+        self.buffers = {}  # filepath -> BytesIO of the downloaded image
+        self.error = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def snapshot(self):
+        """The job's current state as a JobUpdate."""
+        return JobUpdate(self.id, self.status, self.progress, tuple(self.saved_files),
+                         dict(self.buffers), self.error, self.cached)
+
+
+class JobUpdate(namedtuple('JobUpdate', 'id status progress saved_files buffers error cached')):
+    """Immutable copy of a GenerationJob's state at one moment.
+
+    Updates are handed to other threads as these rather than the job itself,
+    so each one reports the state it was sent for.
+    """
+
+    __slots__ = ()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+
+class GenerationManager:
+    """Run BaiduImageGenerator jobs on background threads.
+
+    on_update(update) is called from worker threads with a JobUpdate whenever
+    a job changes, so GUI callers should hand it over to the Tk thread (e.g.
+    via a queue). Each job reports a finished status exactly once.
+    With a GenerationCache, repeated requests are answered from the cache
+    instead of generating again.
+    """
+
+    def __init__(self, generator, max_workers=4, on_update=None, cache=None):
+        self.generator = generator
+        self.on_update = on_update
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.jobs = []
+
+    def submit(self, prompt, width, height, count=1, use_cache=True):
+        """Start count independent generations and return their jobs.
+
+        use_cache=False always generates afresh (the result is still cached).
+        """
+        jobs = []
+        for variant in range(count):
+            job = GenerationJob(prompt, width, height, variant, use_cache)
+            jobs.append(job)
+            self.jobs.append(job)
+            self.executor.submit(self._run, job)
+        return jobs
+
+    def shutdown(self):
+        """Cancel every unfinished job and stop the worker threads."""
+        for job in self.jobs:
+            if not job.finished:
+                job.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _notify(self, job):
+        if self.on_update:
+            self.on_update(job.snapshot())
+
+    def _run(self, job):
+        if job.cancel_event.is_set():
+            job.status = 'cancelled'
+            self._notify(job)
+            return
+
+        job.status = 'running'
+        self._notify(job)
+        with stage('generation_job', job=job.id, width=job.width, height=job.height) as s:
+            self._generate(job)
+            s.add(status=job.status, images=len(job.saved_files))
+        self._notify(job)
+
+    def _from_cache(self, job):
+        """Fill job from the cache. Returns False on a miss."""
+        paths = self.cache.lookup(job.prompt, job.width, job.height, job.variant)
+        if not paths:
+            return False
+        destinations = [self.generator.image_path(job.prompt, i, tag=job.id) for i in range(len(paths))]
+        job.saved_files = self.cache.export(paths, destinations)
+        for filepath in job.saved_files:
+            with open(filepath, 'rb') as f:
+                job.buffers[filepath] = io.BytesIO(f.read())
+        job.progress = 100
+        job.cached = True
+        job.status = 'done'
+        return True
+
+    def _generate(self, job):
+        try:
+            if self.cache is not None and job.use_cache and self._from_cache(job):
+                return
+            result = self.generator.generate_image(job.prompt, job.width, job.height)
+            if not result:
+                raise Exception("Failed to start generation")
+            if 'status' not in result or 'taskid' not in result:
+                raise Exception("Invalid response format")
+
+            def on_progress(progress):
+                job.progress = progress
+                self._notify(job)
+
+            final_result = self.generator.wait_for_completion(
+                result['taskid'], job.prompt,
+                result.get('token', ''), result.get('timestamp', ''),
+                progress_callback=on_progress,
+                cancel_event=job.cancel_event
+            )
+            if job.cancel_event.is_set():
+                job.status = 'cancelled'
+            elif not final_result:
+                raise Exception("Generation failed or timed out")
+            else:
+                saved = self.generator.save_images(final_result, job.prompt, tag=job.id, return_buffers=True)
+                job.saved_files = [filepath for filepath, _ in saved]
+                job.buffers = dict(saved)
+                if not job.saved_files:
+                    raise Exception("No images were saved")
+                if self.cache is not None:
+                    self.cache.store(job.prompt, job.width, job.height, job.saved_files, job.variant)
+                job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
@@ -0,0 +1,310 @@
+"""Persistent queue of generation prompts for long unattended runs.
+
+Prompts are stored in SQLite together with the taskid/token/timestamp the
+generate endpoint hands back, so a queue that is stopped (or crashes) picks
+up where it left off: tasks already started remotely are polled again
+instead of being regenerated, and everything else is started from scratch.
+
+    python generation_queue.py --add prompts.txt --generate-rate 1 --query-rate 5
+    python generation_queue.py            # resume whatever is left
+"""
+import argparse
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from generation_cache import GenerationCache
+
+# queued -> starting -> polling -> downloading -> done, or failed after max_attempts
+ACTIVE_STATUSES = ('starting', 'polling', 'downloading')
+
+
+class GenerationQueue:
+    """Run queued prompts through a BaiduImageGenerator at up to max_in_flight at once.
+
+    Starting and downloading run on a pool of `workers` threads; polling is
+    left to the generator's shared TaskPoller, so waiting tasks don't hold a
+    thread. Rate limits come from the generator (generate_rate/query_rate).
+    With a GenerationCache, jobs matching an earlier request finish straight
+    from the cache.
+    """
+
+    def __init__(self, generator, path='generation_queue.sqlite', workers=4, max_in_flight=16,
+                 max_attempts=3, job_timeout=300, cache=None):
+        self.generator = generator
+        self.cache = cache
+        self.path = path
+        self.max_attempts = max_attempts
+        self.job_timeout = job_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._max_in_flight = max_in_flight
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                prompt TEXT NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                taskid TEXT,
+                token TEXT,
+                timestamp TEXT,
+                variant INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                files TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")]
+        if 'variant' not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN variant INTEGER NOT NULL DEFAULT 0")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        self.conn.commit()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            cursor = self.conn.execute(sql, params)
+            self.conn.commit()
+            return cursor
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def add(self, prompt, width=480, height=640, count=1):
+        """Queue count generations of prompt. Returns the new job ids."""
+        now = time.time()
+        ids = []
+        with self._lock:
+            for variant in range(count):
+                cursor = self.conn.execute(
+                    "INSERT INTO jobs (prompt, width, height, variant, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (prompt, width, height, variant, now, now)
+                )
+                ids.append(cursor.lastrowid)
+            self.conn.commit()
+        self._wakeup.set()
+        return ids
+
+    def counts(self):
+        """Number of jobs per status."""
+        with self._lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def pending(self):
+        counts = self.counts()
+        return sum(counts.get(status, 0) for status in ('queued',) + ACTIVE_STATUSES)
+
+    def _claim(self):
+        """Mark the oldest queued job as starting and return it, or None."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT id, prompt, width, height, variant FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE jobs SET status = 'starting', attempts = attempts + 1, updated_at = ? "
+                              "WHERE id = ?", (time.time(), row[0]))
+            self.conn.commit()
+        return row
+
+    def _recover(self):
+        """Resume jobs left active by a previous run. Returns the ones to poll again."""
+        with self._lock:
+            # Nothing was recorded remotely for these, so just start them again
+            self.conn.execute("UPDATE jobs SET status = 'queued', attempts = attempts - 1 "
+                              "WHERE status = 'starting'")
+            self.conn.execute("UPDATE jobs SET status = 'polling' WHERE status = 'downloading'")
+            self.conn.commit()
+            return self.conn.execute(
+                "SELECT id, prompt, width, height, variant, taskid, token, timestamp FROM jobs "
+                "WHERE status = 'polling' ORDER BY id"
+            ).fetchall()
+
+    def run(self, until_empty=True, progress_callback=None):
+        """Process the queue on the calling thread until it drains (or stop() is called).
+
+        progress_callback(counts) is called whenever a job finishes.
+        """
+        self._stop.clear()
+        self._progress_callback = progress_callback
+        for job_id, prompt, width, height, variant, task_id, token, timestamp in self._recover():
+            self._slots.acquire()
+            self._poll((job_id, prompt, width, height, variant), task_id, token, timestamp)
+
+        while not self._stop.is_set():
+            if not self._slots.acquire(timeout=0.5):
+                continue
+            job = self._claim()
+            if job is None:
+                self._slots.release()
+                # Queued and active from one query: a job failing between
+                # _claim() and here is back in 'queued', not lost
+                if until_empty and self.pending() == 0:
+                    break
+                self._wakeup.wait(1.0)
+                self._wakeup.clear()
+                continue
+            self.executor.submit(self._start, *job)
+
+        if self._stop.is_set():
+            # Started jobs stay in the database and resume on the next run
+            return
+        # Wait for the jobs already started to settle
+        for _ in range(self._max_in_flight):
+            self._slots.acquire()
+        for _ in range(self._max_in_flight):
+            self._slots.release()
+
+    def stop(self):
+        """Stop claiming new jobs; started ones still finish or stay resumable."""
+        self._stop.set()
+        self._wakeup.set()
+
+    def close(self):
+        self.stop()
+        self.executor.shutdown(wait=True)
+        with self._lock:
+            self.conn.close()
+
+    def _start(self, job_id, prompt, width, height, variant):
+        job = (job_id, prompt, width, height, variant)
+        try:
+            paths = self.cache.lookup(prompt, width, height, variant) if self.cache is not None else None
+            if paths:
+                destinations = [self.generator.image_path(prompt, i, tag=f"q{job_id}") for i in range(len(paths))]
+                files = self.cache.export(paths, destinations)
+            else:
+                result = self.generator.generate_image(prompt, width, height)
+                if not result or 'taskid' not in result:
+                    raise Exception("Failed to start generation")
+        except Exception as e:
+            self._fail(job_id, str(e))
+            return
+        if paths:
+            self._done(job_id, files)
+            return
+        token = result.get('token', '')
+        timestamp = result.get('timestamp', '')
+        self._update(job_id, status='polling', taskid=result['taskid'], token=token, timestamp=timestamp)
+        self._poll(job, result['taskid'], token, timestamp)
+
+    def _poll(self, job, task_id, token, timestamp):
+        future = self.generator.poller.submit(task_id, job[1], token, timestamp, timeout=self.job_timeout)
+        future.add_done_callback(lambda f: self._submit(self._download, job, f))
+
+    def _submit(self, fn, *args):
+        try:
+            self.executor.submit(fn, *args)
+        except RuntimeError:
+            # Closed while the task was polling; it is resumed on the next run
+            pass
+
+    def _download(self, job, future):
+        job_id, prompt, width, height, variant = job
+        try:
+            final_result = future.result()
+            if not final_result:
+                raise Exception("Generation failed or timed out")
+            self._update(job_id, status='downloading')
+            saved = self.generator.save_images(final_result, prompt, tag=f"q{job_id}")
+            if not saved:
+                raise Exception("No images were saved")
+            if self.cache is not None:
+                self.cache.store(prompt, width, height, saved, variant)
+        except Exception as e:
+            self._fail(job_id, str(e))
+            return
+        self._done(job_id, saved)
+
+    def _done(self, job_id, files):
+        self._update(job_id, status='done', files=json.dumps(files), error=None)
+        self._finished()
+
+    def _fail(self, job_id, error):
+        with self._lock:
+            attempts = self.conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+        status = 'queued' if attempts < self.max_attempts else 'failed'
+        self._update(job_id, status=status, taskid=None, token=None, timestamp=None, error=error)
+        self._finished()
+
+    def _finished(self):
+        self._slots.release()
+        self._wakeup.set()
+        if self._progress_callback:
+            self._progress_callback(self.counts())
+
+
+def read_prompts(path):
+    """One prompt per line; blank lines and lines starting with # are ignored."""
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+def main(argv=None):
+    from image_generate import BaiduImageGenerator
+
+    parser = argparse.ArgumentParser(description="Queue prompts and generate them unattended.")
+    parser.add_argument('--db', default='generation_queue.sqlite', help="queue database")
+    parser.add_argument('--add', metavar='FILE', help="file with one prompt per line to queue first")
+    parser.add_argument('--size', default='480x640', metavar='WxH', help="size for --add (default: 480x640)")
+    parser.add_argument('--count', type=int, default=1, help="generations per prompt for --add")
+    parser.add_argument('--workers', type=int, default=4, help="threads starting and downloading jobs")
+    parser.add_argument('--max-in-flight', type=int, default=16, help="jobs started but not finished")
+    parser.add_argument('--generate-rate', type=float, default=None, metavar='RPS',
+                        help="max generate requests per second")
+    parser.add_argument('--query-rate', type=float, default=None, metavar='RPS',
+                        help="max query requests per second")
+    parser.add_argument('--max-attempts', type=int, default=3)
+    parser.add_argument('--job-timeout', type=float, default=300, help="seconds to wait for one generation")
+    parser.add_argument('--output-dir', default='generated_images')
+    parser.add_argument('--cache-dir', default='.generation_cache', help="dedup cache of generated images")
+    parser.add_argument('--cache-mb', type=int, default=1024, help="size limit of the cache in MB")
+    parser.add_argument('--no-cache', action='store_true', help="always generate, never reuse cached images")
+    parser.add_argument('--add-only', action='store_true', help="queue prompts without running")
+    args = parser.parse_args(argv)
+
+    generator = BaiduImageGenerator(output_dir=args.output_dir, generate_rate=args.generate_rate,
+                                    query_rate=args.query_rate)
+    cache = None if args.no_cache else GenerationCache(args.cache_dir, args.cache_mb * 1024 * 1024)
+    job_queue = GenerationQueue(generator, args.db, workers=args.workers, max_in_flight=args.max_in_flight,
+                                max_attempts=args.max_attempts, job_timeout=args.job_timeout, cache=cache)
+    if args.add:
+        width, height = (int(n) for n in args.size.lower().split('x'))
+        prompts = read_prompts(args.add)
+        for prompt in prompts:
+            job_queue.add(prompt, width, height, args.count)
+        print(f"Queued {len(prompts) * args.count} jobs")
+    if args.add_only:
+        job_queue.close()
+        return 0
+
+    def report(counts):
+        print(", ".join(f"{status}: {n}" for status, n in sorted(counts.items())))
+
+    try:
+        job_queue.run(progress_callback=report)
+    except KeyboardInterrupt:
+        print("Stopping; run again to resume")
+        job_queue.stop()
+    finally:
+        job_queue.close()
+    if cache is not None:
+        stats = cache.get_stats()
+        print(f"Cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} requests, "
+              f"{stats['bytes'] / (1024 * 1024):.1f} MB")
+        cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,168 @@
+"""Headless batch converter sharing the pipeline used by Process Images.
+
+Example:
+    python image_cli.py photos/ "scans/**/*.png" --format webp --quality 80 --workers 8
+    python image_cli.py inbox/ --watch --format jpg --quality 85
+"""
+import argparse
+import configparser
+import sys
+from batch_processor import BatchProcessor, iter_image_files, presets_from_config
+from directory_watcher import DirectoryWatcher
+from image_resize import RESIZE_MODES, RESAMPLE_FILTERS
+from compression import parse_byte_size
+from color_ops import COLOR_OPS, parse_color_ops
+import instrumentation
+
+
+def parse_size(value):
+    try:
+        width, height = value.lower().split('x')
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size '{value}', expected WIDTHxHEIGHT")
+
+
+def parse_color_list(value):
+    try:
+        return parse_color_ops(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Convert, resize and compress images in bulk.")
+    parser.add_argument('paths', nargs='+', help="image files, directories or glob patterns")
+    parser.add_argument('-f', '--format', default='png', choices=['png', 'jpg', 'webp', 'avif'],
+                        help="target format (default: png)")
+    parser.add_argument('-q', '--quality', type=int, default=None,
+                        help="compression quality 1-100; enables compression")
+    parser.add_argument('--target-size', type=parse_byte_size, default=None, metavar='BYTES',
+                        help="search JPEG/WEBP/AVIF quality to fit this size, e.g. 150KB")
+    parser.add_argument('--target-similarity', type=float, default=None, metavar='SSIM',
+                        help="search for the lowest quality reaching this SSIM, e.g. 0.95")
+    parser.add_argument('--max-iterations', type=int, default=8,
+                        help="encodes tried per image by the quality search (default: 8)")
+    parser.add_argument('--png-time-budget', type=float, default=None, metavar='SECONDS',
+                        help="most time spent per image searching for the smallest lossless PNG; "
+                             "enables compression (default with -q: 10)")
+    parser.add_argument('-r', '--resize', type=parse_size, default=None, metavar='WxH',
+                        help="resize every image to WIDTHxHEIGHT")
+    parser.add_argument('--resize-mode', default='exact', choices=RESIZE_MODES,
+                        help="exact stretches, fit/longest keep the aspect ratio, fill crops (default: exact)")
+    parser.add_argument('--filter', default='bicubic', choices=list(RESAMPLE_FILTERS),
+                        help="resampling filter (default: bicubic)")
+    parser.add_argument('--color', type=parse_color_list, default=None, metavar='OPS',
+                        help=f"comma separated colour operations: {', '.join(COLOR_OPS)}")
+    parser.add_argument('--background', default='white',
+                        help="colour alpha is flattened onto with --color flatten (default: white)")
+    parser.add_argument('--color-batch', type=int, default=None, metavar='N',
+                        help="same-sized images processed together by --color (default: 8; not with --watch)")
+    parser.add_argument('-p', '--preset', default=None,
+                        help="produce the renditions of a [PRESET <name>] section instead of one output")
+    parser.add_argument('-c', '--config', default='config.ini',
+                        help="config file holding the presets (default: config.ini)")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="worker processes (default: CPU count)")
+    parser.add_argument('--memory-budget', type=parse_byte_size, default=None, metavar='BYTES',
+                        help="memory allowed per worker, e.g. 2GB; new files wait while it is used up")
+    parser.add_argument('--no-recursive', action='store_true',
+                        help="do not descend into subdirectories")
+    parser.add_argument('--incremental', action='store_true',
+                        help="skip files unchanged since the last run with the same settings")
+    parser.add_argument('--manifest', default='.batch_manifest.sqlite',
+                        help="manifest used by --incremental (default: .batch_manifest.sqlite)")
+    parser.add_argument('--metrics', default=None, metavar='FILE',
+                        help="append per-stage timings as JSON lines to FILE")
+    parser.add_argument('--profile-dir', default=None, metavar='DIR',
+                        help="write cProfile dumps of the batch and of each worker process to DIR")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep watching the given directories and process images as they arrive")
+    parser.add_argument('--watch-interval', type=float, default=1.0, metavar='SECONDS',
+                        help="how often watched directories are rescanned (default: 1)")
+    parser.add_argument('--settle-time', type=float, default=2.0, metavar='SECONDS',
+                        help="a file must be unchanged this long before it is processed (default: 2)")
+    parser.add_argument('--process-existing', action='store_true',
+                        help="with --watch, also process files already present at startup")
+    parser.add_argument('--quiet', action='store_true', help="only print the final summary")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.watch and args.color_batch is not None:
+        # Watched files are processed as they arrive, one at a time
+        parser.error("--color-batch cannot be used with --watch")
+    if args.metrics or args.profile_dir:
+        instrumentation.configure(metrics=args.metrics, profile=args.profile_dir)
+
+    settings = {
+        'format': args.format,
+        'compress': args.quality is not None or args.png_time_budget is not None,
+        'quality': args.quality if args.quality is not None else 95,
+        'resize': args.resize is not None,
+        'width': args.resize[0] if args.resize else None,
+        'height': args.resize[1] if args.resize else None,
+        'resize_mode': args.resize_mode,
+        'resample': args.filter,
+    }
+    if args.color:
+        settings['color_ops'] = args.color
+        settings['background'] = args.background
+        settings['color_batch'] = args.color_batch or 8
+    if args.png_time_budget is not None:
+        settings['png_time_budget'] = args.png_time_budget
+    if args.target_size or args.target_similarity:
+        settings['target_size'] = args.target_size
+        settings['target_similarity'] = args.target_similarity
+        settings['max_iterations'] = args.max_iterations
+    if args.preset:
+        config = configparser.ConfigParser()
+        config.read(args.config)
+        presets = presets_from_config(config)
+        if args.preset not in presets:
+            print(f"Unknown preset '{args.preset}' in {args.config}", file=sys.stderr)
+            return 2
+        settings['renditions'] = presets[args.preset]
+
+    def on_progress(done, total, filepath, error):
+        if error:
+            print(f"FAILED {filepath}: {error}", file=sys.stderr)
+        elif not args.quiet:
+            print(f"[{done}] {filepath}")
+
+    if args.watch:
+        return watch(args, settings, on_progress)
+
+    files = iter_image_files(args.paths, recursive=not args.no_recursive)
+    result = BatchProcessor(args.workers, args.memory_budget).run(files, settings, progress_callback=on_progress,
+                                              manifest_path=args.manifest if args.incremental else None)
+
+    print(result.summary())
+    return 1 if result.failures else 0
+
+
+def watch(args, settings, on_progress):
+    done = [0]
+
+    def on_result(filepath, outputs, error):
+        done[0] += 1
+        on_progress(done[0], None, filepath, error)
+
+    watcher = DirectoryWatcher(args.paths, settings, recursive=not args.no_recursive,
+                               interval=args.watch_interval, settle_time=args.settle_time,
+                               max_workers=args.workers, process_existing=args.process_existing,
+                               on_result=on_result, memory_budget=args.memory_budget,
+                               manifest_path=args.manifest if args.incremental else None)
+    print(f"Watching {', '.join(args.paths)} (Ctrl+C to stop)")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    print(f"Processed {watcher.processed} images, {watcher.failed} failed")
+    return 1 if watcher.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,27 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import time
+import io
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import unquote, urlparse
+from task_poller import TaskPoller
+from rate_limiter import RateLimiter
+import instrumentation
+from instrumentation import stage
+from image_io import write_atomically
+
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+# Download chunk sizes are picked from Content-Length within these bounds
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
 
 class BaiduImageGenerator:
-    def __init__(self):
+    def __init__(self, connect_timeout=5, read_timeout=30, max_retries=3, backoff_factor=0.5, pool_size=10,
+                 download_workers=4, output_dir="generated_images", generate_rate=None, query_rate=None):
         self.url = "https://image.baidu.com/aigc/generate"
         self.query_url = "https://image.baidu.com/aigc/query"
         
@@ -20,9 +36,72 @@ class BaiduImageGenerator:
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
         }
         
-        self.output_dir = "generated_images"
+        self.output_dir = output_dir
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
+        
+        # One pooled session so polls and downloads reuse keep-alive connections
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.download_workers = download_workers
+        self.backoff_factor = backoff_factor
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        self._stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'bytes_sent': 0, 'bytes_received': 0, 'throttled_s': 0.0}
+        
+        # Optional requests-per-second caps for the generate and query endpoints
+        self.generate_limiter = RateLimiter(generate_rate) if generate_rate else None
+        self.query_limiter = RateLimiter(query_rate) if query_rate else None
+        
+        # All outstanding tasks share one adaptive polling thread
+        self.poller = TaskPoller(self.query_task)
+
+    def get_stats(self):
+        """Return a snapshot of the request, retry and byte counters."""
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def _count(self, **amounts):
+        with self._stats_lock:
+            for key, amount in amounts.items():
+                self.stats[key] += amount
+
+    def _request(self, method, url, limiter=None, **kwargs):
+        """Send a request on the shared session, retrying 5xx and connection errors.
+
+        Waits backoff_factor * 2**attempt seconds between attempts and raises
+        the last error once max_retries is exhausted. With a limiter, every
+        attempt (retries included) first waits for its rate limit.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._count(retries=1)
+                time.sleep(self.backoff_factor * (2 ** (attempt - 1)))
+            if limiter is not None:
+                self._count(throttled_s=limiter.acquire())
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self._count(requests=1)
+                if attempt == self.max_retries:
+                    raise
+                continue
+            
+            body = response.request.body
+            self._count(requests=1, bytes_sent=len(body) if body else 0)
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                response.close()
+                continue
+            
+            response.raise_for_status()
+            if not kwargs.get('stream'):
+                self._count(bytes_received=len(response.content))
+            return response
 
     def generate_image(self, prompt, width=480, height=640):
         data = {
@@ -37,9 +116,11 @@ class BaiduImageGenerator:
         }
 
         try:
-            response = requests.post(self.url, data=data, headers=self.generate_headers)
-            response.raise_for_status()
-            return response.json()
+            with stage('generate_image', width=width, height=height) as s:
+                response = self._request('POST', self.url, limiter=self.generate_limiter, data=data,
+                                         headers=self.generate_headers)
+                s.add(bytes_in=len(response.content))
+                return response.json()
         except requests.exceptions.RequestException as e:
             print(f"Error making request: {e}")
             return None
@@ -57,65 +138,124 @@ class BaiduImageGenerator:
         }
 
         try:
-            response = requests.get(
-                self.query_url, 
-                params=params,  # Use params for GET request
-                headers=self.query_headers
-            )
-            response.raise_for_status()
-            return response.json()
+            with stage('query_task', task_id=task_id) as s:
+                response = self._request(
+                    'GET',
+                    self.query_url, 
+                    limiter=self.query_limiter,
+                    params=params,  # Use params for GET request
+                    headers=self.query_headers
+                )
+                s.add(bytes_in=len(response.content))
+                return response.json()
         except requests.exceptions.RequestException as e:
             print(f"Error querying task: {e}")
             return None
 
-    def wait_for_completion(self, task_id, prompt, token, timestamp, max_attempts=30, delay=2):
-        """Poll the task status until completion or max attempts reached."""
-        for attempt in range(max_attempts):
-            result = self.query_task(task_id, prompt, token, timestamp)
-            if not result:
-                return None
+    def wait_for_completion(self, task_id, prompt, token, timestamp, timeout=60,
+                            progress_callback=None, cancel_event=None):
+        """Wait until the task completes, fails or timeout seconds pass.
 
-            if result.get('isGenerate', False) and result.get('progress', 0) == 100:
-                return result
-            
-            print(f"Progress: {result.get('progress', 0)}%")
-            time.sleep(delay)
-        
-        return None
+        Polling is done by the shared TaskPoller, which adapts the interval to
+        the reported progress. progress_callback(progress) receives every
+        reported percentage, and setting cancel_event stops waiting early,
+        returning None.
+        """
+        future = self.poller.submit(task_id, prompt, token, timestamp,
+                                    progress_callback=progress_callback,
+                                    cancel_event=cancel_event,
+                                    timeout=timeout)
+        return future.result()
+
+    def _chunk_size(self, response):
+        """Aim for ~8 chunks per download, bounded by MIN/MAX_CHUNK_SIZE."""
+        try:
+            length = int(response.headers.get('Content-Length', 0))
+        except ValueError:
+            length = 0
+        return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, length // 8))
+
+    def _stream_to(self, url, f):
+        with stage('download_image', url=url) as s, self._request('GET', url, stream=True) as response:
+            received = 0
+            for chunk in response.iter_content(chunk_size=self._chunk_size(response)):
+                f.write(chunk)
+                received += len(chunk)
+            # Counted once per download rather than taking the stats lock per chunk
+            self._count(bytes_received=received)
+            if instrumentation.enabled:
+                s.add(bytes_in=received)
 
     def download_image(self, url, filename):
-        """Download an image from URL."""
+        """Download an image from URL.
+
+        The file only appears under filename once complete, so a crash never
+        leaves a truncated image behind.
+        """
         try:
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-            with open(filename, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            write_atomically(filename, lambda f: self._stream_to(url, f))
             return True
         except Exception as e:
             print(f"Error downloading image: {e}")
             return False
 
-    def save_images(self, result, prompt):
-        """Save all generated images from the result."""
+    def download_image_buffer(self, url, filename):
+        """Download an image into memory and atomically write it to filename.
+
+        Returns the in-memory buffer, or None on failure.
+        """
+        buffer = io.BytesIO()
+        try:
+            self._stream_to(url, buffer)
+            write_atomically(filename, lambda f: f.write(buffer.getbuffer()))
+        except Exception as e:
+            print(f"Error downloading image: {e}")
+            return None
+        buffer.seek(0)
+        return buffer
+
+    def image_path(self, prompt, index, tag=None, timestamp=None):
+        """Path in output_dir for the index-th image of a generation."""
+        timestamp = timestamp or int(time.time())
+        # Create filenames from prompt
+        safe_prompt = "".join(x for x in prompt[:30] if x.isalnum() or x in (' ', '-', '_'))
+        if tag:
+            filename = f"{safe_prompt}_{timestamp}_{tag}_{index+1}.jpg"
+        else:
+            filename = f"{safe_prompt}_{timestamp}_{index+1}.jpg"
+        return os.path.join(self.output_dir, filename)
+
+    def save_images(self, result, prompt, tag=None, return_buffers=False):
+        """Save all generated images from the result.
+
+        Images are downloaded concurrently, up to download_workers at a time.
+        tag is added to the filenames so concurrent jobs for the same prompt
+        don't overwrite each other. With return_buffers the result is a list of
+        (filepath, BytesIO) pairs instead of plain file paths.
+        """
         if 'picArr' not in result:
             return []
 
-        saved_files = []
         timestamp = int(time.time())
-        
+        downloads = []
         for i, pic in enumerate(result['picArr']):
             url = pic.get('src')
             if not url:
                 continue
-                
-            # Create filename from prompt
-            safe_prompt = "".join(x for x in prompt[:30] if x.isalnum() or x in (' ', '-', '_'))
-            filename = f"{safe_prompt}_{timestamp}_{i+1}.jpg"
-            filepath = os.path.join(self.output_dir, filename)
-            
-            if self.download_image(url, filepath):
-                saved_files.append(filepath)
+            downloads.append((url, self.image_path(prompt, i, tag, timestamp)))
+
+        if not downloads:
+            return []
+
+        fetch = self.download_image_buffer if return_buffers else self.download_image
+        workers = min(self.download_workers, len(downloads))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(lambda d: fetch(*d), downloads))
+
+        saved_files = []
+        for (url, filepath), outcome in zip(downloads, outcomes):
+            if outcome:
+                saved_files.append((filepath, outcome) if return_buffers else filepath)
                 print(f"Saved image to: {filepath}")
 
         return saved_files
@@ -144,7 +284,10 @@ def main():
     
     # Wait for completion
     print("\nWaiting for generation to complete...")
-    final_result = generator.wait_for_completion(task_id, prompt, token, timestamp)
+    final_result = generator.wait_for_completion(
+        task_id, prompt, token, timestamp,
+        progress_callback=lambda progress: print(f"Progress: {progress}%")
+    )
     
     if not final_result:
         print("Generation failed or timed out")
@@ -158,6 +301,10 @@ def main():
             print(f"- {file}")
     else:
         print("No images were saved")
+    
+    stats = generator.get_stats()
+    print(f"\nRequests: {stats['requests']}, retries: {stats['retries']}, "
+          f"bytes sent: {stats['bytes_sent']}, bytes received: {stats['bytes_received']}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,150 @@
+"""File I/O for the batch pipeline: reusable encode buffers, atomic outputs
+and a memory budget for admitting work.
+
+Inputs are decoded from their path, which lets Pillow map uncompressed
+files itself without the pages being held twice.
+"""
+import io
+import os
+import tempfile
+import threading
+from PIL import Image
+
+class EncodeBuffer(io.RawIOBase):
+    """In-memory file whose storage is kept between uses.
+
+    Unlike BytesIO, reset() keeps the allocation, so encoding one image
+    after another in a worker doesn't allocate and free an output-sized
+    block each time. getbuffer() is a view of the written bytes; release it
+    (e.g. ``with buffer.getbuffer() as view:``) before writing again.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._data = bytearray()
+        self._size = 0
+        self._pos = 0
+
+    def reset(self):
+        self._size = 0
+        self._pos = 0
+        return self
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def write(self, b):
+        data = memoryview(b).cast('B')
+        end = self._pos + data.nbytes
+        if end > len(self._data):
+            # Grow geometrically; the bytearray is never shrunk
+            self._data.extend(bytes(max(end - len(self._data), len(self._data))))
+        self._data[self._pos:end] = data
+        self._pos = end
+        self._size = max(self._size, end)
+        return data.nbytes
+
+    def readinto(self, b):
+        view = memoryview(b).cast('B')
+        n = max(0, min(view.nbytes, self._size - self._pos))
+        view[:n] = self._data[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def truncate(self, size=None):
+        self._size = self._pos if size is None else size
+        return self._size
+
+    def getbuffer(self):
+        return memoryview(self._data)[:self._size]
+
+    def getvalue(self):
+        return bytes(self._data[:self._size])
+
+
+_local = threading.local()
+
+
+def encode_buffer():
+    """The calling thread's EncodeBuffer, emptied and ready to write."""
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None:
+        buffer = _local.buffer = EncodeBuffer()
+    return buffer.reset()
+
+
+def write_atomically(path, write):
+    """Call write(f) on a temp file next to path, then rename it into place.
+
+    Readers (and a crash) only ever see the old file or the complete new one,
+    which also makes converting a file onto itself safe.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def estimate_memory(path):
+    """Rough peak bytes needed to process path: decoded pixels plus a working copy.
+
+    Only the header is read. Unreadable files count as zero so they fail in
+    the worker with a proper error.
+    """
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            bands = len(img.getbands())
+    except Exception:
+        return 0
+    return width * height * bands * 2
+
+
+class MemoryBudget:
+    """Admission control for work items with estimated memory costs.
+
+    try_acquire() succeeds while the items in flight fit in limit; a single
+    item larger than the whole limit is still admitted when nothing else is
+    running, so it is processed alone instead of never.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.count = 0
+
+    def try_acquire(self, cost):
+        if self.count and self.in_use + cost > self.limit:
+            return False
+        self.in_use += cost
+        self.count += 1
+        return True
+
+    def release(self, cost):
+        self.in_use -= cost
+        self.count -= 1
@@ -0,0 +1,68 @@
+from PIL import Image
+
+try:
+    import pillow_avif  # noqa: F401  registers the AVIF plugin on Pillow < 11.2
+except ImportError:
+    pass
+
+Image.init()
+# Pillow decodes AVIF straight into its own buffer, without the NumPy
+# round trip imageio needs
+PILLOW_AVIF = '.avif' in Image.registered_extensions()
+
+
+def open_image(source, target_size=None):
+    """Open an image as a PIL Image.
+
+    source is a path or a binary file object. AVIF goes through Pillow when
+    it has an AVIF codec and falls back to imageio otherwise. When
+    target_size is given the codec may decode at a reduced scale that is
+    still at least target_size, so callers must still resize the result
+    themselves.
+    """
+    if not PILLOW_AVIF and isinstance(source, str) and source.lower().endswith('avif'):
+        return _open_avif_imageio(source)
+
+    img = Image.open(source)
+    if target_size:
+        reduce_on_decode(img, target_size)
+    return img
+
+
+def _open_avif_imageio(path):
+    import imageio.v2 as imageio
+
+    frame = imageio.imread(path, plugin='avif')
+    img = Image.fromarray(frame)
+    # fromarray may share or copy the array; either way drop our reference
+    # so at most one full-size frame stays alive
+    del frame
+    return img
+
+
+def reduce_on_decode(img, target_size):
+    """Ask the codec for reduced-size output before any pixels are decoded.
+
+    Only JPEG supports this (DCT scaling to 1/2, 1/4 or 1/8 via draft mode);
+    other formats are left untouched. Returns True if the decode was reduced.
+    """
+    if img.format != 'JPEG':
+        return False
+    width, height = target_size
+    if img.width < width * 2 or img.height < height * 2:
+        return False
+    return img.draft(None, (int(width), int(height))) is not None
+
+
+def save_avif(img, fp, quality=95):
+    """Encode img as AVIF to a path or binary file object."""
+    if PILLOW_AVIF:
+        img.save(fp, 'AVIF', quality=quality)
+        return
+
+    import numpy as np
+    import imageio.v3 as iio
+
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+    iio.imwrite(fp, np.asarray(img), extension='.avif', quality=quality)
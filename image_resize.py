@@ -0,0 +1,71 @@
+from PIL import Image
+
+RESIZE_MODES = ('exact', 'fit', 'fill', 'longest')
+
+RESAMPLE_FILTERS = {
+    'nearest': Image.Resampling.NEAREST,
+    'box': Image.Resampling.BOX,
+    'bilinear': Image.Resampling.BILINEAR,
+    'hamming': Image.Resampling.HAMMING,
+    'bicubic': Image.Resampling.BICUBIC,
+    'lanczos': Image.Resampling.LANCZOS,
+}
+
+# Past this much shrinking, reduce() by an integer factor first and run the
+# filter over the last REDUCING_GAP times of the reduction only
+TWO_STAGE_FACTOR = 2.0
+REDUCING_GAP = 3.0
+
+
+def scaled_size(source_size, size, mode='exact'):
+    """Size the whole source is scaled to before any cropping.
+
+    exact   stretch to size
+    fit     largest size inside the box, keeping the aspect ratio
+    fill    smallest size covering the box, keeping the aspect ratio
+            (the overflow is cropped by resize_image)
+    longest scale so the longest edge equals max(size)
+    """
+    src_w, src_h = source_size
+    width, height = size
+    if mode == 'exact':
+        return width, height
+    if mode == 'fit':
+        scale = min(width / src_w, height / src_h)
+    elif mode == 'fill':
+        scale = max(width / src_w, height / src_h)
+    elif mode == 'longest':
+        scale = max(width, height) / max(src_w, src_h)
+    else:
+        raise ValueError(f"unknown resize mode '{mode}'")
+    return max(1, round(src_w * scale)), max(1, round(src_h * scale))
+
+
+def resize_image(img, size, mode='exact', resample='bicubic'):
+    """Resize img to size with the given mode and filter name.
+
+    Big reductions are done in two stages: a fast integer reduce() followed
+    by the chosen filter, which is far cheaper than filtering the full
+    source and visually indistinguishable at REDUCING_GAP.
+    """
+    if resample not in RESAMPLE_FILTERS:
+        raise ValueError(f"unknown resample filter '{resample}'")
+    target = scaled_size(img.size, size, mode)
+    box = None
+    if mode == 'fill':
+        # Only filter the part of the source that survives the crop
+        width, height = size
+        crop_w = img.width * width / target[0]
+        crop_h = img.height * height / target[1]
+        left = (img.width - crop_w) / 2
+        top = (img.height - crop_h) / 2
+        box = (left, top, left + crop_w, top + crop_h)
+        target = (width, height)
+
+    if target == img.size and box is None:
+        return img
+
+    src_w, src_h = (box[2] - box[0], box[3] - box[1]) if box else img.size
+    reduction = min(src_w / target[0], src_h / target[1])
+    reducing_gap = REDUCING_GAP if reduction >= TWO_STAGE_FACTOR else None
+    return img.resize(target, RESAMPLE_FILTERS[resample], box=box, reducing_gap=reducing_gap)
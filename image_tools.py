@@ -1,20 +1,29 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from tkinter import ttk
-from PIL import Image, ImageTk
-import imageio.v2 as imageio
 import os
 import configparser
 import requests
 import base64
 import json
+import queue
+import threading
 from image_generate import BaiduImageGenerator
+from batch_processor import BatchProcessor, presets_from_config
+from image_resize import RESIZE_MODES, RESAMPLE_FILTERS
+from color_ops import parse_color_ops
+from generation_manager import GenerationManager
+from generation_cache import GenerationCache
+from directory_watcher import DirectoryWatcher
+from thumbnail_cache import ThumbnailCache
+from thumbnail_grid import ThumbnailGrid
+import instrumentation
 
 class ResizeDialog:
-    def __init__(self, parent, initial_width, initial_height):
+    def __init__(self, parent, initial_width, initial_height, initial_mode='exact', initial_filter='bicubic'):
         self.dialog = tk.Toplevel(parent)
         self.dialog.title("Resize Settings")
-        self.dialog.geometry("300x150")
+        self.dialog.geometry("300x220")
         self.dialog.resizable(False, False)
         
         width_frame = ttk.Frame(self.dialog)
@@ -31,6 +40,20 @@ class ResizeDialog:
         self.height_entry.pack(side='left', padx=5)
         self.height_entry.insert(0, initial_height)
         
+        mode_frame = ttk.Frame(self.dialog)
+        mode_frame.pack(fill='x', padx=10, pady=5)
+        ttk.Label(mode_frame, text="Mode:").pack(side='left')
+        self.mode_var = tk.StringVar(value=initial_mode)
+        self.mode_menu = ttk.OptionMenu(mode_frame, self.mode_var, initial_mode, *RESIZE_MODES)
+        self.mode_menu.pack(side='left', padx=5)
+        
+        filter_frame = ttk.Frame(self.dialog)
+        filter_frame.pack(fill='x', padx=10, pady=5)
+        ttk.Label(filter_frame, text="Filter:").pack(side='left')
+        self.filter_var = tk.StringVar(value=initial_filter)
+        self.filter_menu = ttk.OptionMenu(filter_frame, self.filter_var, initial_filter, *RESAMPLE_FILTERS)
+        self.filter_menu.pack(side='left', padx=5)
+        
         button_frame = ttk.Frame(self.dialog)
         button_frame.pack(fill='x', padx=10, pady=10)
         ttk.Button(button_frame, text="OK", command=self.ok).pack(side='right', padx=5)
@@ -39,17 +62,18 @@ class ResizeDialog:
         self.result = None
     
     def ok(self):
-        self.result = (self.width_entry.get(), self.height_entry.get())
+        self.result = (self.width_entry.get(), self.height_entry.get(),
+                       self.mode_var.get(), self.filter_var.get())
         self.dialog.destroy()
     
     def cancel(self):
         self.dialog.destroy()
 
 class CompressionDialog:
-    def __init__(self, parent, initial_quality):
+    def __init__(self, parent, initial_quality, initial_target_kb='', initial_similarity=''):
         self.dialog = tk.Toplevel(parent)
         self.dialog.title("Compression Settings")
-        self.dialog.geometry("300x150")
+        self.dialog.geometry("300x240")
         self.dialog.resizable(False, False)
         
         ttk.Label(self.dialog, text="Compression Quality:").pack(padx=10, pady=5)
@@ -67,6 +91,21 @@ class CompressionDialog:
         self.value_label.pack(pady=5)
         self.slider.config(command=self.update_label)
         
+        # Optional targets: quality above becomes the upper bound of the search
+        target_frame = ttk.Frame(self.dialog)
+        target_frame.pack(fill='x', padx=10, pady=5)
+        ttk.Label(target_frame, text="Target size (KB):").pack(side='left')
+        self.target_entry = ttk.Entry(target_frame, width=10)
+        self.target_entry.pack(side='left', padx=5)
+        self.target_entry.insert(0, initial_target_kb)
+        
+        similarity_frame = ttk.Frame(self.dialog)
+        similarity_frame.pack(fill='x', padx=10, pady=5)
+        ttk.Label(similarity_frame, text="Min similarity (0-1):").pack(side='left')
+        self.similarity_entry = ttk.Entry(similarity_frame, width=10)
+        self.similarity_entry.pack(side='left', padx=5)
+        self.similarity_entry.insert(0, initial_similarity)
+        
         button_frame = ttk.Frame(self.dialog)
         button_frame.pack(fill='x', padx=10, pady=10)
         ttk.Button(button_frame, text="OK", command=self.ok).pack(side='right', padx=5)
@@ -78,7 +117,7 @@ class CompressionDialog:
         self.value_label.config(text=f"Quality: {int(float(value))}%")
     
     def ok(self):
-        self.result = self.quality.get()
+        self.result = (self.quality.get(), self.target_entry.get().strip(), self.similarity_entry.get().strip())
         self.dialog.destroy()
     
     def cancel(self):
@@ -139,6 +178,47 @@ class PromptDialog:
     def cancel(self):
         self.dialog.destroy()
 
+class GenerationPanel:
+    """Window listing running generations with progress and cancel buttons."""
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.dialog = None
+        self.rows = {}
+
+    def _ensure_window(self):
+        if self.dialog is not None and self.dialog.winfo_exists():
+            return
+        self.dialog = tk.Toplevel(self.parent)
+        self.dialog.title("Generation Jobs")
+        self.dialog.geometry("450x250")
+        self.dialog.protocol("WM_DELETE_WINDOW", self.dialog.withdraw)
+        self.rows = {}
+
+    def add_job(self, job):
+        self._ensure_window()
+        self.dialog.deiconify()
+
+        row = ttk.Frame(self.dialog)
+        row.pack(fill='x', padx=10, pady=5)
+        ttk.Label(row, text=job.prompt[:20], width=20).pack(side='left')
+        progress_var = tk.DoubleVar(value=job.progress)
+        ttk.Progressbar(row, variable=progress_var, maximum=100, length=150).pack(side='left', padx=5)
+        status_label = ttk.Label(row, text=job.status, width=10)
+        status_label.pack(side='left')
+        cancel_button = ttk.Button(row, text="Cancel", command=job.cancel)
+        cancel_button.pack(side='right')
+        self.rows[job.id] = (progress_var, status_label, cancel_button)
+
+    def update_job(self, job):
+        if job.id not in self.rows:
+            return
+        progress_var, status_label, cancel_button = self.rows[job.id]
+        progress_var.set(job.progress)
+        status_label.config(text=job.status)
+        if job.finished:
+            cancel_button.config(state='disabled')
+
 class ImageToolsApp:
     def __init__(self, root):
         self.root = root
@@ -149,8 +229,16 @@ class ImageToolsApp:
         self.config_file = "config.ini"
         self.load_config()
         
+        # Optional per-stage metrics, off unless configured
+        metrics_file = self.config['SETTINGS'].get('metrics_file')
+        profile_dir = self.config['SETTINGS'].get('profile_dir')
+        if metrics_file or profile_dir:
+            instrumentation.configure(metrics=metrics_file, profile=profile_dir)
+        
         self.files = []
-        self.thumbnails = []
+        # Freshly downloaded images, so thumbnails don't re-read them from disk
+        self.image_buffers = {}
+        self.thumbnail_cache = ThumbnailCache()
         
         # Configure grid layout
         self.root.columnconfigure(0, weight=1)
@@ -171,6 +259,13 @@ class ImageToolsApp:
         self.ai_menu = tk.Menu(self.menu, tearoff=0)
         self.menu.add_cascade(label="AI Tools", menu=self.ai_menu)
         self.ai_menu.add_command(label="Generate Image", command=self.show_generate_dialog)
+        
+        # Watch menu
+        self.watch_menu = tk.Menu(self.menu, tearoff=0)
+        self.menu.add_cascade(label="Watch", menu=self.watch_menu)
+        self.watch_menu.add_command(label="Watch Folder...", command=self.start_watching)
+        self.watch_menu.add_command(label="Stop Watching", command=self.stop_watching, state='disabled')
+        self.watch_menu.add_command(label="Show Failures", command=self.show_watch_failures, state='disabled')
        
         
         # File selection
@@ -183,9 +278,7 @@ class ImageToolsApp:
         self.canvas = tk.Canvas(root, width=780, height=400, bg="white")
         self.scroll_y = tk.Scrollbar(root, orient="vertical", command=self.canvas.yview)
         
-        self.frame = ttk.Frame(self.canvas)
-        self.canvas.create_window((0, 0), window=self.frame, anchor="nw")
-        self.frame.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
+        self.thumbnail_grid = ThumbnailGrid(self.canvas, self.scroll_y, self.thumbnail_cache)
         
         # Create an empty label for "No images" message
         self.empty_label = ttk.Label(root, text="No images selected", foreground="gray")
@@ -195,7 +288,7 @@ class ImageToolsApp:
         self.format_label = ttk.Label(root, text="Convert to Format:")
         self.format_label.grid(row=2, column=0, padx=10, pady=10, sticky="w")
         self.format_var = tk.StringVar(value="png")
-        self.format_options = ["png", "jpg", "webp"]
+        self.format_options = ["png", "jpg", "webp", "avif"]
         self.format_menu = ttk.OptionMenu(root, self.format_var, *self.format_options)
         self.format_menu.grid(row=2, column=1, padx=10, pady=10, sticky="e")
         
@@ -220,11 +313,61 @@ class ImageToolsApp:
         )
         self.compress_check.pack(side="left", padx=5)
         
+        self.incremental_var = tk.BooleanVar(value=False)
+        self.incremental_check = ttk.Checkbutton(
+            self.options_frame, 
+            text="Skip unchanged", 
+            variable=self.incremental_var
+        )
+        self.incremental_check.pack(side="left", padx=5)
+        
+        # Presets from config.ini produce several renditions per image
+        self.presets = presets_from_config(self.config)
+        ttk.Label(self.options_frame, text="Preset:").pack(side="left", padx=(15, 0))
+        self.preset_var = tk.StringVar(value="(none)")
+        self.preset_menu = ttk.OptionMenu(self.options_frame, self.preset_var, "(none)", "(none)", *self.presets)
+        self.preset_menu.pack(side="left", padx=5)
+        
         # Process button
         self.process_button = ttk.Button(root, text="Process Images", command=self.process_images)
         self.process_button.grid(row=3, column=0, columnspan=2, padx=10, pady=20)
         
+        # Batch progress - hidden until a batch is running
+        self.progress_var = tk.DoubleVar(value=0)
+        self.progress_bar = ttk.Progressbar(root, variable=self.progress_var, maximum=100)
+        self.progress_label = ttk.Label(root, text="")
+        
+        # Watch mode status - hidden unless a folder is being watched
+        self.watch_label = ttk.Label(root, text="")
+        self.watch_queue = queue.Queue()
+        self.watch_stop = None
+        
         self.image_generator = BaiduImageGenerator()
+        # Optional per-worker memory cap for batches of very large scans
+        memory_budget_mb = self.config['SETTINGS'].getint('memory_budget_mb', 0)
+        self.batch_processor = BatchProcessor(memory_budget=memory_budget_mb * 1024 * 1024 or None)
+        self.batch_queue = queue.Queue()
+        
+        # Generations run on worker threads and report back through generation_queue
+        self.generation_queue = queue.Queue()
+        # Repeated prompts are answered from the dedup cache unless it's turned off
+        self.generation_cache = None
+        if self.config['SETTINGS'].getboolean('generation_cache', True):
+            cache_mb = int(self.config['SETTINGS'].get('generation_cache_mb', '1024'))
+            self.generation_cache = GenerationCache(max_bytes=cache_mb * 1024 * 1024)
+        self.generation_manager = GenerationManager(
+            self.image_generator,
+            on_update=self.generation_queue.put,
+            cache=self.generation_cache
+        )
+        self.generation_panel = GenerationPanel(self.root)
+        self.root.after(200, self._poll_generation_queue)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+    
+    def on_close(self):
+        self.stop_watching()
+        self.generation_manager.shutdown()
+        self.root.destroy()
     
     def load_config(self):
         if os.path.exists(self.config_file):
@@ -235,6 +378,9 @@ class ImageToolsApp:
                 'height': '600',
                 'compression_quality': '95'
             }
+            self.config['PRESET web'] = {
+                'renditions': 'large:1600x1200:jpg:90, medium:800x600:jpg:85, thumb:200x150:webp:80'
+            }
            
             self.save_config()
     
@@ -246,21 +392,33 @@ class ImageToolsApp:
         dialog = ResizeDialog(
             self.root,
             self.config['SETTINGS'].get('width', '800'),
-            self.config['SETTINGS'].get('height', '600')
+            self.config['SETTINGS'].get('height', '600'),
+            self.config['SETTINGS'].get('resize_mode', 'exact'),
+            self.config['SETTINGS'].get('resample', 'bicubic')
         )
         self.root.wait_window(dialog.dialog)
         if dialog.result:
-            width, height = dialog.result
+            width, height, mode, resample = dialog.result
             self.config['SETTINGS']['width'] = width
             self.config['SETTINGS']['height'] = height
+            self.config['SETTINGS']['resize_mode'] = mode
+            self.config['SETTINGS']['resample'] = resample
             self.save_config()
 
     def show_compression_dialog(self):
         initial_quality = int(self.config['SETTINGS'].get('compression_quality', '95'))
-        dialog = CompressionDialog(self.root, initial_quality)
+        dialog = CompressionDialog(
+            self.root,
+            initial_quality,
+            self.config['SETTINGS'].get('target_size_kb', ''),
+            self.config['SETTINGS'].get('target_similarity', '')
+        )
         self.root.wait_window(dialog.dialog)
         if dialog.result is not None:
-            self.config['SETTINGS']['compression_quality'] = str(dialog.result)
+            quality, target_kb, similarity = dialog.result
+            self.config['SETTINGS']['compression_quality'] = str(quality)
+            self.config['SETTINGS']['target_size_kb'] = target_kb
+            self.config['SETTINGS']['target_similarity'] = similarity
             self.save_config()
     
    
@@ -271,60 +429,40 @@ class ImageToolsApp:
         if dialog.result:
             prompt, style, size, count = dialog.result
             width, height = map(int, size.split('x'))
-            self.generate_image(prompt, width, height)
+            self.generate_image(prompt, width, height, count)
 
-    def generate_image(self, prompt, width=640, height=480):
+    def generate_image(self, prompt, width=640, height=480, count=1):
+        """Start count concurrent generations in the background."""
+        for job in self.generation_manager.submit(prompt, width, height, count):
+            self.generation_panel.add_job(job)
+    
+    def _poll_generation_queue(self):
         try:
-            # Generate image using BaiduImageGenerator
-            result = self.image_generator.generate_image(prompt, width, height)
-            if not result:
-                raise Exception("Failed to start generation")
-
-            print("Generation started...")
-            
-            if 'status' not in result or 'taskid' not in result:
-                raise Exception("Invalid response format")
-            
-            task_id = result['taskid']
-            token = result.get('token', '')
-            timestamp = result.get('timestamp', '')
-            
-            # Wait for completion
-            print("\nWaiting for generation to complete...")
-            final_result = self.image_generator.wait_for_completion(task_id, prompt, token, timestamp)
-            
-            if not final_result:
-                raise Exception("Generation failed or timed out")
-            
-            # Save images
-            saved_files = self.image_generator.save_images(final_result, prompt)
-            if saved_files:
-                # Add generated images to the current selection
-                self.files = list(self.files)
-                self.files.extend(saved_files)
-                self.files = tuple(self.files)
-                self.show_thumbnails()
-                messagebox.showinfo("Success", f"Successfully generated {len(saved_files)} images")
-            else:
-                raise Exception("No images were saved")
-                
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to generate image: {str(e)}")
+            while True:
+                update = self.generation_queue.get_nowait()
+                self.generation_panel.update_job(update)
+                if update.status == 'done':
+                    # Add generated images to the current selection
+                    self.image_buffers.update(update.buffers)
+                    self.files = tuple(self.files) + update.saved_files
+                    self.show_thumbnails()
+                elif update.status == 'failed':
+                    messagebox.showerror("Error", f"Failed to generate image: {update.error}")
+        except queue.Empty:
+            pass
+        self.root.after(200, self._poll_generation_queue)
     
     def browse_files(self):
-        self.files = filedialog.askopenfilenames(filetypes=[("Image files", "*.png;*.jpg;*.jpeg;*.webp;*.avif")])
+        self.files = filedialog.askopenfilenames(filetypes=[("Image files", "*.png;*.jpg;*.jpeg;*.webp;*.avif;*.tif;*.tiff")])
         self.show_thumbnails()
     
     def show_thumbnails(self):
-        self.thumbnails = []
-        for widget in self.frame.winfo_children():
-            widget.destroy()
-            
         if not self.files:
             # Hide canvas and scrollbar, show empty message
             self.canvas.grid_remove()
             self.scroll_y.grid_remove()
             self.empty_label.grid()
+            self.thumbnail_grid.set_files([])
             return
             
         # Show canvas and scrollbar, hide empty message
@@ -332,59 +470,197 @@ class ImageToolsApp:
         self.canvas.grid(row=1, column=0, columnspan=2, padx=10, pady=10, sticky="nsew")
         self.scroll_y.grid(row=1, column=2, sticky="ns")
         
-        # Display thumbnails
-        for file in self.files:
-            if file.lower().endswith('avif'):
-                img = imageio.imread(file, plugin='avif')
-                img = Image.fromarray(img)
-            else:
-                img = Image.open(file)
-            img.thumbnail((100, 100))
-            thumbnail = ImageTk.PhotoImage(img)
-            self.thumbnails.append(thumbnail)
-            label = tk.Label(self.frame, image=thumbnail)
-            label.pack(side="left", padx=5, pady=5)
+        # Display thumbnails - only the visible ones are decoded and drawn
+        self.thumbnail_grid.set_files(self.files, self.image_buffers)
+    
+    def _batch_settings(self):
+        """Settings for process_file from the current options, or None if invalid."""
+        settings = {
+            'width': self.config['SETTINGS']['width'],
+            'height': self.config['SETTINGS']['height'],
+            'quality': int(self.config['SETTINGS'].get('compression_quality', '95')),
+            'format': self.format_var.get(),
+            'resize': self.resize_var.get(),
+            'compress': self.compress_var.get(),
+            'resize_mode': self.config['SETTINGS'].get('resize_mode', 'exact'),
+            'resample': self.config['SETTINGS'].get('resample', 'bicubic'),
+        }
+        if self.compress_var.get():
+            # Search the quality per image for a byte budget and/or similarity floor
+            target_kb = self.config['SETTINGS'].get('target_size_kb', '')
+            similarity = self.config['SETTINGS'].get('target_similarity', '')
+            png_budget = self.config['SETTINGS'].get('png_time_budget', '')
+            try:
+                if target_kb:
+                    settings['target_size'] = int(float(target_kb) * 1024)
+                if similarity:
+                    settings['target_similarity'] = float(similarity)
+                if png_budget:
+                    settings['png_time_budget'] = float(png_budget)
+            except ValueError:
+                messagebox.showerror("Error", "Invalid target size, similarity or PNG time budget in settings")
+                return None
+        color_ops = self.config['SETTINGS'].get('color_ops', '')
+        if color_ops:
+            # e.g. "srgb, flatten, autolevel"
+            try:
+                settings['color_ops'] = parse_color_ops(color_ops)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return None
+            settings['background'] = self.config['SETTINGS'].get('background', 'white')
+        preset = self.preset_var.get()
+        if preset in self.presets:
+            settings['renditions'] = self.presets[preset]
+        return settings
     
     def process_images(self):
         if not self.files:
             messagebox.showerror("Error", "Please select images")
             return
         
-        width = self.config['SETTINGS']['width']
-        height = self.config['SETTINGS']['height']
-        compression_quality = int(self.config['SETTINGS'].get('compression_quality', '95'))
-        target_format = self.format_var.get()
+        settings = self._batch_settings()
+        if settings is None:
+            return
+        files = list(self.files)
+        
+        self.process_button.config(state='disabled')
+        self.progress_var.set(0)
+        self.progress_label.config(text=f"Processing 0/{len(files)}")
+        self.progress_bar.grid(row=4, column=0, columnspan=2, padx=10, pady=5, sticky="ew")
+        self.progress_label.grid(row=5, column=0, columnspan=2, padx=10, pady=5)
+        
+        # Run the batch off the Tk thread; progress comes back through batch_queue
+        manifest_path = None
+        if self.incremental_var.get():
+            manifest_path = self.config['SETTINGS'].get('manifest_file', '.batch_manifest.sqlite')
+        thread = threading.Thread(target=self._run_batch, args=(files, settings, manifest_path), daemon=True)
+        thread.start()
+        self.root.after(100, self._poll_batch_queue)
+    
+    def _run_batch(self, files, settings, manifest_path=None):
+        def on_progress(done, total, filepath, error):
+            self.batch_queue.put(('progress', done, total))
         
-        for filepath in self.files:
-            try:
-                if filepath.lower().endswith('avif'):
-                    img = imageio.imread(filepath, plugin='avif')
-                    img = Image.fromarray(img)
+        try:
+            result = self.batch_processor.run(files, settings, progress_callback=on_progress,
+                                              manifest_path=manifest_path)
+            self.batch_queue.put(('done', result))
+        except Exception as e:
+            self.batch_queue.put(('error', str(e)))
+    
+    def _poll_batch_queue(self):
+        try:
+            while True:
+                message = self.batch_queue.get_nowait()
+                if message[0] == 'progress':
+                    done, total = message[1], message[2]
+                    self.progress_var.set(done * 100 / total)
+                    self.progress_label.config(text=f"Processing {done}/{total}")
+                else:
+                    self._finish_batch(message)
+                    return
+        except queue.Empty:
+            pass
+        self.root.after(100, self._poll_batch_queue)
+    
+    def _finish_batch(self, message):
+        self.process_button.config(state='normal')
+        self.progress_bar.grid_remove()
+        self.progress_label.grid_remove()
+        
+        if message[0] == 'error':
+            messagebox.showerror("Error", f"Failed to process images: {message[1]}")
+            return
+        
+        result = message[1]
+        if result.failures:
+            messagebox.showwarning("Completed with errors", result.summary())
+        elif result.skipped:
+            messagebox.showinfo("Success", result.summary())
+        else:
+            messagebox.showinfo("Success", "Images processed successfully")
+
+    def start_watching(self):
+        if self.watch_stop is not None:
+            return
+        directory = filedialog.askdirectory(title="Folder to watch")
+        if not directory:
+            return
+        settings = self._batch_settings()
+        if settings is None:
+            return
+        
+        self.watch_stop = threading.Event()
+        watcher = DirectoryWatcher(
+            [directory], settings,
+            settle_time=float(self.config['SETTINGS'].get('watch_settle_time', '2')),
+            on_result=lambda filepath, outputs, error: self.watch_queue.put((filepath, error))
+        )
+        thread = threading.Thread(target=self._run_watcher, args=(watcher, self.watch_stop), daemon=True)
+        thread.start()
+        
+        self.watch_status = {'directory': directory, 'processed': 0, 'failures': []}
+        self._update_watch_label()
+        self.watch_label.grid(row=6, column=0, columnspan=2, padx=10, pady=5)
+        self.watch_menu.entryconfig("Watch Folder...", state='disabled')
+        self.watch_menu.entryconfig("Stop Watching", state='normal')
+        self.watch_menu.entryconfig("Show Failures", state='disabled')
+        self.root.after(200, self._poll_watch_queue)
+    
+    def _run_watcher(self, watcher, stop_event):
+        try:
+            watcher.run(stop_event)
+        except Exception as e:
+            # Runs on a worker thread; the Tk thread reports it and stops watching
+            self.watch_queue.put((None, str(e)))
+
+    def stop_watching(self):
+        if self.watch_stop is None:
+            return
+        self.watch_stop.set()
+        self.watch_stop = None
+        self.watch_label.grid_remove()
+        self.watch_menu.entryconfig("Watch Folder...", state='normal')
+        self.watch_menu.entryconfig("Stop Watching", state='disabled')
+    
+    def _update_watch_label(self):
+        status = self.watch_status
+        text = f"Watching {status['directory']}: {status['processed']} processed"
+        failures = status['failures']
+        if failures:
+            filepath, error = failures[-1]
+            text += f", {len(failures)} failed (last: {os.path.basename(filepath)}: {error[:60]})"
+        self.watch_label.config(text=text, foreground='red' if failures else '')
+
+    def show_watch_failures(self, max_errors=10):
+        failures = self.watch_status['failures']
+        lines = [f"{len(failures)} failed:"]
+        for filepath, error in failures[-max_errors:]:
+            lines.append(f"- {os.path.basename(filepath)}: {error}")
+        if len(failures) > max_errors:
+            lines.insert(1, f"... {len(failures) - max_errors} earlier failures not shown")
+        messagebox.showerror("Watch Failures", "\n".join(lines))
+    
+    def _poll_watch_queue(self):
+        if self.watch_stop is None:
+            return
+        try:
+            while True:
+                filepath, error = self.watch_queue.get_nowait()
+                if filepath is None:
+                    self.stop_watching()
+                    messagebox.showerror("Error", f"Watching {self.watch_status['directory']} stopped: {error}")
+                    return
+                if error:
+                    self.watch_status['failures'].append((filepath, error))
+                    self.watch_menu.entryconfig("Show Failures", state='normal')
                 else:
-                    img = Image.open(filepath)
-                
-                # Resize image only if checkbox is checked
-                if self.resize_var.get() and width and height:
-                    img = img.resize((int(width), int(height)))
-                
-                # Save with compression settings if enabled
-                quality = compression_quality if self.compress_var.get() else 95
-                
-                new_filename = os.path.splitext(os.path.basename(filepath))[0] + f".{target_format}"
-                new_filepath = os.path.join(os.path.dirname(filepath), new_filename)
-                
-                if target_format.lower() == 'jpg':
-                    img.save(new_filepath, 'JPEG', quality=quality)
-                elif target_format.lower() == 'png':
-                    optimize = self.compress_var.get()
-                    img.save(new_filepath, 'PNG', optimize=optimize)
-                else:  # webp
-                    img.save(new_filepath, 'WEBP', quality=quality)
-                    
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to process {filepath}: {e}")
-        
-        messagebox.showinfo("Success", "Images processed successfully")
+                    self.watch_status['processed'] += 1
+        except queue.Empty:
+            pass
+        self._update_watch_label()
+        self.root.after(200, self._poll_watch_queue)
 
 if __name__ == "__main__":
     root = tk.Tk()
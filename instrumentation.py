@@ -0,0 +1,186 @@
+"""Optional per-stage timing for the processing and generation paths.
+
+Instrumented code wraps each step in ``with stage('decode', file=path) as s:``
+and may attach counters with ``s.add(bytes_in=...)``. When metrics are off
+stage() hands back a shared no-op object, so the only cost is one function
+call. When on, every stage appends one JSON line to the metrics file with
+its duration, counters and the process's peak RSS so far.
+
+Enable with configure(), or through the IMAGE_TOOLS_METRICS and
+IMAGE_TOOLS_PROFILE_DIR environment variables; configure() also sets them
+so batch worker processes pick up the same settings. Batch workers run
+their tasks through profiled_call(), so with profiling on each worker
+writes its own dump next to the dispatcher's.
+"""
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+METRICS_ENV = 'IMAGE_TOOLS_METRICS'
+PROFILE_ENV = 'IMAGE_TOOLS_PROFILE_DIR'
+
+metrics_file = os.environ.get(METRICS_ENV) or None
+profile_dir = os.environ.get(PROFILE_ENV) or None
+enabled = metrics_file is not None
+
+_lock = threading.Lock()
+_handle = None
+
+
+def configure(metrics=None, profile=None):
+    """Turn metrics (a JSON lines file path) and batch profiling (a directory) on or off."""
+    global metrics_file, profile_dir, enabled, _handle
+    with _lock:
+        if _handle is not None:
+            _handle.close()
+            _handle = None
+        metrics_file = metrics or None
+        profile_dir = profile or None
+        enabled = metrics_file is not None
+
+    for name, value in ((METRICS_ENV, metrics_file), (PROFILE_ENV, profile_dir)):
+        if value:
+            os.environ[name] = value
+        else:
+            os.environ.pop(name, None)
+
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def emit(record):
+    """Append one record to the metrics file."""
+    global _handle
+    line = json.dumps(record, default=str) + "\n"
+    with _lock:
+        if metrics_file is None:
+            return
+        if _handle is None:
+            _handle = open(metrics_file, 'a', encoding='utf-8')
+        _handle.write(line)
+        _handle.flush()
+
+
+class _Stage:
+    __slots__ = ('name', 'fields', 'start')
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.start = None
+
+    def add(self, **fields):
+        """Attach counters to this stage; numeric values accumulate."""
+        for key, value in fields.items():
+            if isinstance(value, (int, float)) and isinstance(self.fields.get(key), (int, float)):
+                self.fields[key] += value
+            else:
+                self.fields[key] = value
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record = {
+            'ts': time.time(),
+            'stage': self.name,
+            'duration_ms': (time.perf_counter() - self.start) * 1000,
+            'pid': os.getpid(),
+        }
+        record.update(self.fields)
+        if exc_type is not None:
+            record['error'] = str(exc)
+        peak = _peak_rss_kb()
+        if peak is not None:
+            record['peak_rss_kb'] = peak
+        emit(record)
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def add(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name, **fields):
+    """Context manager timing one step; a no-op unless metrics are enabled."""
+    if not enabled:
+        return _NULL_STAGE
+    return _Stage(name, fields)
+
+
+class _ProfileBatch:
+    def __init__(self, name):
+        self.name = name
+        self.profiler = cProfile.Profile()
+
+    def __enter__(self):
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.disable()
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, f"{self.name}-{os.getpid()}-{int(time.time() * 1000)}.prof")
+        self.profiler.dump_stats(path)
+        return False
+
+
+def profile_batch(name):
+    """Context manager writing a cProfile dump for the wrapped block when a
+    profile directory is configured; a no-op otherwise.
+    """
+    if profile_dir is None:
+        return _NULL_STAGE
+    return _ProfileBatch(name)
+
+
+_worker_profiler = None
+_worker_profile_path = None
+
+
+def profiled_call(func, *args):
+    """Run func(*args), the entry point of a pool worker task. With a profile
+    directory configured, all such calls in one worker process accumulate in
+    one profiler, rewritten to worker-<pid>-<start>.prof after each call so
+    the dump is complete however the pool ends.
+    """
+    global _worker_profiler, _worker_profile_path
+    if profile_dir is None:
+        return func(*args)
+    if _worker_profiler is None:
+        _worker_profiler = cProfile.Profile()
+        _worker_profile_path = os.path.join(profile_dir, f"worker-{os.getpid()}-{int(time.time() * 1000)}.prof")
+    _worker_profiler.enable()
+    try:
+        return func(*args)
+    finally:
+        _worker_profiler.disable()
+        os.makedirs(profile_dir, exist_ok=True)
+        _worker_profiler.dump_stats(_worker_profile_path)
+
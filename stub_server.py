@@ -0,0 +1,148 @@
+"""Local stand-in for the Baidu generate/query/download endpoints.
+
+Used by benchmark.py to run BaiduImageGenerator end to end without the
+network. Every request waits `latency` seconds; a task reports progress
+linearly over `generation_time` seconds and then lists `images_per_task`
+download URLs.
+
+    python stub_server.py --port 8765 --latency 0.05 --generation-time 3
+"""
+import argparse
+import io
+import json
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from PIL import Image
+
+
+def make_stub_image(width=1024, height=1024):
+    """A JPEG with enough detail to be roughly the size of a real result."""
+    img = Image.effect_mandelbrot((width, height), (-2.0, -1.5, 1.0, 1.5), 100).convert('RGB')
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+class StubServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, generation_time=2.0, images_per_task=4,
+                 image_bytes=None):
+        self.latency = latency
+        self.generation_time = generation_time
+        self.images_per_task = images_per_task
+        self.image_bytes = image_bytes if image_bytes is not None else make_stub_image()
+        self.tasks = {}
+        self.request_counts = {'generate': 0, 'query': 0, 'download': 0}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def configure(self, generator):
+        """Point a BaiduImageGenerator at this server."""
+        generator.url = self.base_url + "/aigc/generate"
+        generator.query_url = self.base_url + "/aigc/query"
+
+    def _count(self, name):
+        with self._lock:
+            self.request_counts[name] += 1
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, body, content_type='application/json', status=200):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_json(self, data):
+                self._send(json.dumps(data).encode('utf-8'))
+
+            def do_POST(self):
+                time.sleep(server.latency)
+                length = int(self.headers.get('Content-Length', 0))
+                self.rfile.read(length)
+                if urlparse(self.path).path != '/aigc/generate':
+                    self._send(b'', status=404)
+                    return
+                server._count('generate')
+                task_id = uuid.uuid4().hex
+                with server._lock:
+                    server.tasks[task_id] = time.monotonic()
+                self._send_json({'status': 0, 'taskid': task_id, 'token': 'stub', 'timestamp': str(int(time.time()))})
+
+            def do_GET(self):
+                time.sleep(server.latency)
+                parsed = urlparse(self.path)
+                if parsed.path == '/aigc/query':
+                    server._count('query')
+                    task_id = parse_qs(parsed.query).get('taskid', [''])[0]
+                    started = server.tasks.get(task_id)
+                    if started is None:
+                        self._send(b'', status=404)
+                        return
+                    elapsed = time.monotonic() - started
+                    progress = min(100, int(elapsed / server.generation_time * 100)) if server.generation_time else 100
+                    data = {'status': 0, 'progress': progress, 'isGenerate': progress == 100}
+                    if progress == 100:
+                        data['picArr'] = [{'src': f"{server.base_url}/img/{task_id}/{i}.jpg"}
+                                          for i in range(server.images_per_task)]
+                    self._send_json(data)
+                elif parsed.path.startswith('/img/'):
+                    server._count('download')
+                    self._send(server.image_bytes, content_type='image/jpeg')
+                else:
+                    self._send(b'', status=404)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fake generate/query/download endpoints.")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds added to every request")
+    parser.add_argument('--generation-time', type=float, default=3.0)
+    parser.add_argument('--images', type=int, default=4)
+    args = parser.parse_args()
+
+    server = StubServer(port=args.port, latency=args.latency, generation_time=args.generation_time,
+                        images_per_task=args.images)
+    print(f"Serving on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
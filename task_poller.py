@@ -0,0 +1,139 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+
+class _PollTask:
+    def __init__(self, task_id, prompt, token, timestamp, deadline, progress_callback, cancel_event):
+        self.task_id = task_id
+        self.prompt = prompt
+        self.token = token
+        self.timestamp = timestamp
+        self.deadline = deadline
+        self.progress_callback = progress_callback
+        self.cancel_event = cancel_event
+        self.future = Future()
+        self.interval = None
+        self.last_progress = None
+        self.last_time = None
+
+
+class TaskPoller:
+    """Poll many generation tasks from a single background thread.
+
+    Each task's next poll is scheduled from the rate its progress has been
+    moving at, so fast tasks are checked right around the time they should
+    finish and stalled ones back off. Intervals get some random jitter so
+    many queued prompts don't poll in lockstep.
+    """
+
+    def __init__(self, query, initial_interval=1.0, min_interval=0.5, max_interval=5.0,
+                 jitter=0.2, timeout=60):
+        self.query = query  # query(task_id, prompt, token, timestamp) -> dict or None
+        self.initial_interval = initial_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.timeout = timeout
+
+        self._heap = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def submit(self, task_id, prompt, token, timestamp, progress_callback=None, cancel_event=None,
+               timeout=None):
+        """Start polling a task. Returns a Future resolving to the final result or None."""
+        now = time.monotonic()
+        task = _PollTask(task_id, prompt, token, timestamp,
+                         now + (timeout if timeout is not None else self.timeout),
+                         progress_callback, cancel_event)
+        with self._condition:
+            self._schedule(task, now + self._jittered(self.initial_interval))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="TaskPoller", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return task.future
+
+    def _jittered(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _schedule(self, task, when):
+        heapq.heappush(self._heap, (when, next(self._order), task))
+
+    def _next_interval(self, task, progress, now):
+        """Estimate how long to wait before the task is worth polling again."""
+        if task.last_progress is None or progress <= task.last_progress:
+            # No rate yet, or no movement: back off gradually
+            interval = self.initial_interval if task.interval is None else task.interval * 1.5
+        else:
+            rate = (progress - task.last_progress) / max(now - task.last_time, 1e-3)
+            remaining = (100 - progress) / rate
+            # Land slightly before the estimated finish rather than after it
+            interval = remaining * 0.75
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                while True:
+                    self._drop_cancelled()
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        _, _, task = heapq.heappop(self._heap)
+                        break
+                    # Wake up regularly to notice cancel events
+                    wait = 0.25 if not self._heap else min(0.25, self._heap[0][0] - now)
+                    self._condition.wait(wait)
+
+            self._poll(task)
+
+    def _drop_cancelled(self):
+        kept = []
+        for entry in self._heap:
+            task = entry[2]
+            if task.cancel_event is not None and task.cancel_event.is_set():
+                task.future.set_result(None)
+            else:
+                kept.append(entry)
+        if len(kept) != len(self._heap):
+            heapq.heapify(kept)
+            self._heap = kept
+
+    def _poll(self, task):
+        # A failing query or progress_callback ends this task, not the thread
+        # polling all of them
+        try:
+            self._poll_once(task)
+        except Exception as e:
+            if not task.future.done():
+                task.future.set_exception(e)
+
+    def _poll_once(self, task):
+        result = self.query(task.task_id, task.prompt, task.token, task.timestamp)
+        if not result:
+            task.future.set_result(None)
+            return
+
+        progress = result.get('progress', 0)
+        if task.progress_callback:
+            task.progress_callback(progress)
+        if result.get('isGenerate', False) and progress == 100:
+            task.future.set_result(result)
+            return
+
+        now = time.monotonic()
+        if now >= task.deadline:
+            task.future.set_result(None)
+            return
+
+        task.interval = self._next_interval(task, progress, now)
+        task.last_progress = progress
+        task.last_time = now
+        when = min(now + self._jittered(task.interval), task.deadline)
+        with self._condition:
+            self._schedule(task, when)
@@ -0,0 +1,129 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+from image_loader import open_image
+from image_io import write_atomically
+from instrumentation import stage
+
+
+class ThumbnailCache:
+    """Two level thumbnail cache: an in-memory LRU for the session backed by
+    PNG files on disk.
+
+    Entries are keyed by absolute path, mtime and file size, so edited files
+    get a fresh thumbnail. The disk cache is trimmed oldest-used first once
+    it grows past max_bytes; hits refresh the file's mtime to mark it used.
+    """
+
+    def __init__(self, cache_dir=".thumbnail_cache", max_bytes=100 * 1024 * 1024, size=(100, 100),
+                 memory_items=2000):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.size = size
+        self.memory_items = memory_items
+        self.hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self.cache_dir)
+                               if entry.name.endswith('.png'))
+
+    def _key(self, path):
+        stat = os.stat(path)
+        raw = f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}|{self.size[0]}x{self.size[1]}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, path, buffer=None):
+        """Return a thumbnail PIL Image for path.
+
+        buffer may hold the file's bytes already (e.g. a fresh download), in
+        which case it is decoded instead of reading the file again.
+        """
+        key = self._key(path)
+        with self._lock:
+            img = self._memory.get(key)
+            if img is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return img
+
+        disk_path = os.path.join(self.cache_dir, key + '.png')
+        img = None
+        if os.path.exists(disk_path):
+            try:
+                img = Image.open(disk_path)
+                img.load()
+                os.utime(disk_path)
+                self.hits += 1
+            except OSError:
+                img = None
+
+        if img is None:
+            self.misses += 1
+            with stage('thumbnail', file=path):
+                img = self._render(path, buffer)
+            self._store(disk_path, img)
+
+        self._remember(key, img)
+        return img
+
+    def _render(self, path, buffer):
+        if buffer is not None:
+            buffer.seek(0)
+            img = open_image(buffer, target_size=self.size)
+        else:
+            img = open_image(path, target_size=self.size)
+        img.thumbnail(self.size)
+        if img.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+        return img
+
+    def _remember(self, key, img):
+        with self._lock:
+            self._memory[key] = img
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _store(self, disk_path, img):
+        try:
+            write_atomically(disk_path, lambda f: img.save(f, 'PNG'))
+        except OSError:
+            return
+
+        with self._lock:
+            self._disk_bytes += os.path.getsize(disk_path)
+            over_budget = self._disk_bytes > self.max_bytes
+        if over_budget:
+            self._evict()
+
+    def _evict(self):
+        """Delete least recently used thumbnails until 90% of max_bytes."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.png'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+        with self._lock:
+            self._disk_bytes = total
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
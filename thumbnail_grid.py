@@ -0,0 +1,179 @@
+import queue
+import threading
+from PIL import ImageTk
+
+PLACEHOLDER_COLORS = {'outline': "#dddddd", 'fill': "#f4f4f4"}
+FAILED_COLORS = {'outline': "#e0a0a0", 'fill': "#fbe9e9"}
+
+
+class ThumbnailGrid:
+    """Virtualized thumbnail grid drawn directly on a canvas.
+
+    Only the rows in view (plus a little overscan) get canvas items and
+    PhotoImages; items scrolled out of view are recycled for the ones coming
+    in. Thumbnails are produced by a background thread through the
+    ThumbnailCache and handed back to the Tk thread in the order they
+    appear on screen, so memory stays flat however many files are selected.
+    A thumbnail that fails to load gets a red placeholder and is not asked
+    for again until the next set_files().
+    """
+
+    def __init__(self, canvas, scrollbar, thumbnail_cache, cell_size=110, overscan_rows=1):
+        self.canvas = canvas
+        self.scrollbar = scrollbar
+        self.cache = thumbnail_cache
+        self.cell_size = cell_size
+        self.overscan_rows = overscan_rows
+
+        self.files = []
+        self.buffers = {}
+        self.columns = 1
+        self.generation = 0
+
+        self.slots = {}       # file index -> (placeholder item, image item)
+        self.free_slots = []  # recycled (placeholder item, image item)
+        self.photos = {}      # file index -> PhotoImage for visible slots
+        self.failed = {}      # file index -> error, for this generation
+
+        self._wanted = []
+        self._wanted_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._results = queue.Queue()
+        self._worker = threading.Thread(target=self._decode_loop, name="ThumbnailGrid", daemon=True)
+        self._worker.start()
+
+        self.canvas.configure(yscrollcommand=self._on_yscroll, yscrollincrement=cell_size // 2)
+        self.scrollbar.configure(command=self._on_scrollbar)
+        self.canvas.bind("<Configure>", lambda e: self._relayout())
+        self.canvas.bind("<MouseWheel>", self._on_mousewheel)
+        self.canvas.bind("<Button-4>", lambda e: self._scroll_units(-1))
+        self.canvas.bind("<Button-5>", lambda e: self._scroll_units(1))
+        self.canvas.after(30, self._poll_results)
+
+    def set_files(self, files, buffers=None):
+        """Show a new selection; buffers maps paths to already loaded bytes."""
+        self.generation += 1
+        self.files = list(files)
+        self.failed = {}
+        self.buffers = buffers if buffers is not None else {}
+        for index in list(self.slots):
+            self._release(index)
+        self.canvas.yview_moveto(0)
+        self._relayout()
+
+    def _relayout(self):
+        width = max(self.canvas.winfo_width(), self.cell_size)
+        columns = max(1, width // self.cell_size)
+        if columns != self.columns:
+            self.columns = columns
+            for index in list(self.slots):
+                self._release(index)
+
+        rows = (len(self.files) + self.columns - 1) // self.columns
+        self.canvas.configure(scrollregion=(0, 0, self.columns * self.cell_size, rows * self.cell_size))
+        self.refresh()
+
+    def _on_yscroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.refresh()
+
+    def _on_scrollbar(self, *args):
+        self.canvas.yview(*args)
+
+    def _on_mousewheel(self, event):
+        self._scroll_units(-1 if event.delta > 0 else 1)
+
+    def _scroll_units(self, amount):
+        self.canvas.yview_scroll(amount, "units")
+
+    def _visible_range(self):
+        top = self.canvas.canvasy(0)
+        bottom = self.canvas.canvasy(self.canvas.winfo_height())
+        first_row = max(0, int(top // self.cell_size) - self.overscan_rows)
+        last_row = int(bottom // self.cell_size) + self.overscan_rows
+        start = first_row * self.columns
+        end = min(len(self.files), (last_row + 1) * self.columns)
+        return range(start, end)
+
+    def refresh(self):
+        """Materialize the visible cells and queue their thumbnails."""
+        visible = self._visible_range()
+        for index in list(self.slots):
+            if index not in visible:
+                self._release(index)
+
+        wanted = []
+        for index in visible:
+            if index not in self.slots:
+                self._place(index)
+            if index not in self.photos and index not in self.failed:
+                wanted.append((self.generation, index, self.files[index]))
+
+        # Replace, not extend, so off-screen requests are dropped
+        with self._wanted_lock:
+            self._wanted = wanted
+        if wanted:
+            self._wake.set()
+
+    def _place(self, index):
+        if self.free_slots:
+            placeholder, image_item = self.free_slots.pop()
+        else:
+            placeholder = self.canvas.create_rectangle(0, 0, 0, 0)
+            image_item = self.canvas.create_image(0, 0, anchor="center")
+
+        row, column = divmod(index, self.columns)
+        x = column * self.cell_size
+        y = row * self.cell_size
+        pad = 5
+        self.canvas.coords(placeholder, x + pad, y + pad, x + self.cell_size - pad, y + self.cell_size - pad)
+        self.canvas.coords(image_item, x + self.cell_size // 2, y + self.cell_size // 2)
+        colors = FAILED_COLORS if index in self.failed else PLACEHOLDER_COLORS
+        self.canvas.itemconfigure(placeholder, state="normal", **colors)
+        self.canvas.itemconfigure(image_item, image="", state="normal")
+        self.slots[index] = (placeholder, image_item)
+
+    def _release(self, index):
+        placeholder, image_item = self.slots.pop(index)
+        self.canvas.itemconfigure(placeholder, state="hidden")
+        self.canvas.itemconfigure(image_item, image="", state="hidden")
+        self.photos.pop(index, None)
+        self.free_slots.append((placeholder, image_item))
+
+    def _decode_loop(self):
+        while True:
+            self._wake.wait()
+            with self._wanted_lock:
+                if not self._wanted:
+                    self._wake.clear()
+                    continue
+                generation, index, path = self._wanted.pop(0)
+
+            try:
+                img = self.cache.get(path, buffer=self.buffers.pop(path, None))
+            except Exception as e:
+                self._results.put((generation, index, None, str(e)))
+            else:
+                self._results.put((generation, index, img, None))
+
+    def _poll_results(self):
+        try:
+            while True:
+                generation, index, img, error = self._results.get_nowait()
+                if generation != self.generation:
+                    continue
+                if error is not None:
+                    # Remembered so refresh() doesn't ask for it again
+                    self.failed[index] = error
+                    if index in self.slots:
+                        self.canvas.itemconfigure(self.slots[index][0], **FAILED_COLORS)
+                    continue
+                if index not in self.slots:
+                    continue
+                # PhotoImage must be created on the Tk thread
+                photo = ImageTk.PhotoImage(img)
+                self.photos[index] = photo
+                self.canvas.itemconfigure(self.slots[index][1], image=photo)
+        except queue.Empty:
+            pass
+        self.canvas.after(30, self._poll_results)